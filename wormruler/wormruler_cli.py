@@ -0,0 +1,301 @@
+from argparse import ArgumentParser
+from json import load as json_load
+from os.path import exists, getsize, getmtime, basename, dirname
+from multiprocessing import freeze_support
+from sys import stdin, exit
+from time import sleep, time
+
+from wormruler_core import DEFAULT_SETTINGS, ExperimentIndex, CacheManifest, read_roi_file, process_video, \
+    run_videos, normalize_lengths, analyze_condition, growing_frames, pipe_frames, synthetic_frames, live_lengths, \
+    format_length, correct_experiment, skeletonize_experiment, process_experiment, normalize_experiment, \
+    analyze_experiment, run_experiment, pulse_frame, check_kernels
+
+
+"""
+-----
+WormRuler command line
+
+Runs the steps of WormRuler without GUI (and without display). Settings are read from a JSON file (--config)
+with the names of DEFAULT_SETTINGS in wormruler_core.py, options given on the command line replace them:
+
+    {"gamma": 1.1, "pulse_start": 10, "workers": 4, "skeleton_engine": "native"}
+
+correct, skeletonize, process (both in one pass), normalize, analyze: one step for all videos of a folder
+all: all steps, videos are normalized as soon as they are skeletonized (like "Start all")
+
+    python wormruler_cli.py all <video root> --config settings.json
+
+Libraries needed by a step (FilFinder, pandas, ...) are only loaded when it runs.
+
+watch: processes new videos of a WormRuler folder (<video root>/<condition>/*.avi) while they are recorded.
+Every video whose file did not change for --settle seconds is background corrected and skeletonized,
+its lengths are normalized and the <condition>_results.xlsx of its condition is written again.
+The ROI has to be selected before (<video root>/<root name>_ROI.txt).
+
+    python wormruler_cli.py watch <video root> --pulse-start 10 --gamma 1.0 --workers 4
+
+live: measures the length of the worm in every frame of a video which is still recorded (--file),
+of raw grayscale frames from the standard input (--pipe WIDTHxHEIGHT) or of a synthetic worm (--synthetic)
+and prints it as soon as the frame is measured. Frames are dropped (length None) if measuring falls behind
+by more than --queue frames.
+
+    ffmpeg -i <camera> -f rawvideo -pix_fmt gray - | python wormruler_cli.py live --pipe 640x480 --roi <ROI.txt>
+
+kernels: compares the kernels compiled by numba (--kernels numba) with skimage on the background corrected videos
+of a folder, exits with status 1 if their results differ.
+
+    python wormruler_cli.py kernels "../Example Videos"
+-----
+"""
+
+
+# command line options of the settings: (option, setting, type, help)
+SETTING_OPTIONS = [
+    ("--gamma", "gamma", float, "gamma value for background correction"),
+    ("--framerate", "framerate", int, "framerate of the videos (fps)"),
+    ("--pulse-start", "pulse_start", int, "start of the light pulse (s)"),
+    ("--lower-bound", "lower_bound", float, "lowest normalized length"),
+    ("--upper-bound", "upper_bound", float, "highest normalized length"),
+    ("--workers", "workers", int, "videos (or chunks of videos) processed in parallel"),
+    ("--chunk-frames", "chunk_frames", int, "frames of a chunk (several workers, saved by --checkpoint)"),
+    ("--batch-frames", "batch_frames", int, "frames thresholded together"),
+    ("--segmentation", "segmentation", ["otsu", "background"], "threshold per frame or median background"),
+    ("--cleanup", "cleanup", ["morphology", "largest"], "remove small objects and holes or only clean up the worm"),
+    ("--background-samples", "background_samples", int, "frames of the median background"),
+    ("--downscale", "downscale", int, "downscale videos by this factor while decoding"),
+    ("--engine", "skeleton_engine", ["filfinder", "native", "parity"], "skeleton length measurement"),
+    ("--kernels", "kernels", ["skimage", "numba"], "thinning and morphology by skimage or compiled by numba"),
+    ("--tracking-margin", "tracking_margin", int, "margin around the worm with --tracking (pixels)"),
+    ("--memo-frames", "memo_frames", int, "different frames whose results are reused"),
+    ("--save-gifs", "save_gifs", bool, "write *_bw.gif and *_skel.gif"),
+    ("--crop-first", "crop_first", bool, "crop raw videos to the ROI before background correction"),
+    ("--tracking", "tracking", bool, "skeletonize only the surroundings of the worm in the previous frame"),
+    ("--checkpoint", "checkpoint", bool, "save finished chunks, interrupted videos continue from them"),
+    ("--abort-unusable", "abort_unusable", bool, "stop videos with no length in half of their frames"),
+    ("--pipeline-frames", "pipeline_frames", int, "frames queued between decoding, processing and writing (0: off)"),
+]
+
+
+def add_setting_options(parser):
+    parser.add_argument("--config", help="JSON file with settings")
+    for option, name, kind, text in SETTING_OPTIONS:
+        if kind is bool:
+            parser.add_argument(option, dest=name, action="store_true", default=None, help=text)
+        elif isinstance(kind, list):
+            parser.add_argument(option, dest=name, choices=kind, help=text)
+        else:
+            parser.add_argument(option, dest=name, type=kind, help=text)
+
+
+# settings of the processing functions: defaults, settings of the config file and options of the command line
+def parse_settings(parser, args):
+    settings = dict(DEFAULT_SETTINGS)
+    settings["save_gifs"] = False
+    if args.config:
+        with open(args.config) as f:
+            config = json_load(f)
+        unknown = [name for name in config if name not in DEFAULT_SETTINGS]
+        if unknown:
+            parser.error("unknown settings in " + args.config + ": " + ", ".join(unknown))
+        settings.update(config)
+    for option, name, kind, text in SETTING_OPTIONS:
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+    settings["workers"] = max(1, int(settings["workers"]))
+    settings["downscale"] = max(1, int(settings["downscale"]))
+    return settings
+
+
+# videos which are still written by the recording software are not processed:
+# a video is complete if its size and modification time did not change between two scans
+# and it was last modified at least settle seconds ago
+class CompleteVideos(object):
+
+    def __init__(self, settle):
+        self.settle = settle
+        self.sizes = {}
+
+    def complete(self, v_path, state):
+        previous = self.sizes.get(v_path)
+        self.sizes[v_path] = state
+        return state == previous and time() - state[1] >= self.settle
+
+
+def file_state(path):
+    return getsize(path), getmtime(path)
+
+
+# scans the video root every interval seconds and processes complete videos without up to date results
+def watch(video_root, settings, interval, settle):
+    video_root = video_root.rstrip("/\\") + "/"
+    root_name = basename(video_root[:-1])
+    roi_path = video_root + root_name + "_ROI.txt"
+    pulsestart_f = pulse_frame(settings)
+    videos = CompleteVideos(settle)
+    # size and modification time of videos which were processed, up to date or failed
+    done = {}
+
+    print("Watching " + video_root + " for new videos...")
+    while True:
+        if not exists(roi_path):
+            print("Please select the ROI first (" + roi_path + ").")
+            sleep(interval)
+            continue
+        settings["roi"] = read_roi_file(roi_path)
+        index = ExperimentIndex(video_root)
+        manifest = CacheManifest(video_root)
+
+        # videos are only checked again if they changed,
+        # videos which were renamed or deleted since the folder was scanned are skipped
+        complete = []
+        for v_path in index.videos():
+            try:
+                state = file_state(v_path)
+            except OSError:
+                continue
+            if done.get(v_path) != state and videos.complete(v_path, state):
+                complete.append(v_path)
+                done[v_path] = state
+        video_paths = manifest.stale(process_video, complete, settings)
+        if video_paths:
+            print("New videos: " + str(video_paths) + "\n")
+
+            def finished(v_path):
+                data_path = normalize_lengths(v_path[:-4] + "_raw_lengths.txt", pulsestart_f,
+                                              settings["lower_bound"], settings["upper_bound"])
+                if data_path is not None:
+                    index.add(data_path)
+
+            try:
+                run_videos(process_video, video_paths, settings, manifest=manifest, finished=finished)
+            except Exception as error:
+                print("Error while processing " + str(video_paths) + ": " + repr(error))
+
+            # results of all conditions with new videos are written again
+            conditions = set(index.condition(dirname(v_path)) for v_path in video_paths)
+            for folder in index.conditions:
+                if folder in conditions and index.data(folder):
+                    analyze_condition(video_root, folder, index.data(folder))
+            print("Waiting for new videos...")
+        sleep(interval)
+
+
+# prints the length of every frame of a live source, lengths are also written to output (like *_raw_lengths.txt)
+def live(frames, settings, queue_frames, output=None):
+    framerate = int(settings["framerate"])
+    lengths = open(output, "w") if output else None
+    print("frame\ttime (s)\tlength\tlatency (ms)")
+    try:
+        for num, length, latency in live_lengths(frames, settings, queue_frames):
+            delay = "dropped" if latency is None else "%.0f" % (latency * 1000)
+            print("%d\t%.2f\t%s\t%s" % (num, num / framerate, length, delay), flush=True)
+            if lengths is not None:
+                lengths.write(format_length(length))
+                lengths.flush()
+    finally:
+        if lengths is not None:
+            lengths.close()
+
+
+# frames of the live source selected on the command line, cropped to the ROI and downscaled
+def live_source(args, settings):
+    roi = read_roi_file(args.roi) if args.roi else None
+    scale = int(settings["downscale"])
+    if args.file:
+        return growing_frames(args.file, args.timeout, roi, scale)
+    if args.pipe:
+        width, height = (int(value) for value in args.pipe.lower().split("x"))
+        return pipe_frames(stdin.buffer, width, height, roi, scale)
+    return synthetic_frames(pulse_frame=args.synthetic_pulse, framerate=int(settings["framerate"]), roi=roi,
+                            scale=scale)
+
+
+# prints the progress of a step
+def print_progress(done, total):
+    print("%d/%d" % (done, total), flush=True)
+
+
+# steps for all videos of a folder: command -> (function, help)
+STEP_COMMANDS = {
+    "correct": (correct_experiment, "background correction, writes *_bw.npz"),
+    "skeletonize": (skeletonize_experiment, "skeletonization of *_bw.npz, writes *_raw_lengths.txt"),
+    "process": (process_experiment, "background correction and skeletonization in one pass"),
+    "normalize": (normalize_experiment, "normalization of *_raw_lengths.txt, writes *_data.txt"),
+    "analyze": (analyze_experiment, "data analysis, writes <condition>_results.xlsx"),
+    "all": (run_experiment, "all steps, each video is normalized as soon as it is skeletonized"),
+}
+
+
+def run_command(command, video_root, settings, force):
+    if command in ("correct", "skeletonize", "process"):
+        STEP_COMMANDS[command][0](video_root, settings, print_progress, force)
+    elif command == "normalize":
+        normalize_experiment(video_root, settings, print_progress)
+    elif command == "analyze":
+        analyze_experiment(video_root, print_progress)
+    else:
+        run_experiment(video_root, settings, print_progress, force=force)
+
+
+def main():
+    parser = ArgumentParser(description="WormRuler command line")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # options of all commands
+    common = ArgumentParser(add_help=False)
+    add_setting_options(common)
+
+    for command, (function, text) in STEP_COMMANDS.items():
+        step_parser = commands.add_parser(command, parents=[common], help=text)
+        step_parser.add_argument("video_root", help="folder with one subfolder per condition")
+        step_parser.add_argument("--force", action="store_true", help="process videos with up to date results again")
+
+    watch_parser = commands.add_parser("watch", parents=[common],
+                                       help="process new videos of a WormRuler folder continuously")
+    watch_parser.add_argument("video_root", help="folder with one subfolder per condition")
+    watch_parser.add_argument("--interval", type=float, default=10, help="seconds between scans of the folder")
+    watch_parser.add_argument("--settle", type=float, default=30,
+                              help="videos are processed when they were not modified for this many seconds")
+
+    live_parser = commands.add_parser("live", parents=[common], help="print lengths of a video while it is recorded")
+    sources = live_parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--file", help="video file which is still written")
+    sources.add_argument("--pipe", metavar="WIDTHxHEIGHT", help="raw 8 bit grayscale frames from the standard input")
+    sources.add_argument("--synthetic", action="store_true", help="synthetic worm instead of a camera")
+    live_parser.add_argument("--synthetic-pulse", type=int, default=100, help="frame of the synthetic light pulse")
+    live_parser.add_argument("--roi", help="*_ROI.txt the frames are cropped to")
+    live_parser.add_argument("--output", help="lengths are also written to this file")
+    live_parser.add_argument("--queue", type=int, default=8, help="frames waiting at most to be measured")
+    live_parser.add_argument("--timeout", type=float, default=10,
+                             help="--file: stop if the file did not grow for this many seconds")
+
+    kernels_parser = commands.add_parser("kernels", help="compare the numba kernels with skimage")
+    kernels_parser.add_argument("video_root", help="folder with background corrected videos (*_bw.npz or *_bw.gif)")
+    kernels_parser.add_argument("--frames", type=int, help="frames compared per video (default: all)")
+
+    args = parser.parse_args()
+    # kernels has no settings
+    if args.command == "kernels":
+        if not check_kernels(ExperimentIndex(args.video_root).masks(), args.frames):
+            exit(1)
+        return
+    settings = parse_settings(parser, args)
+    if args.command in ("normalize", "all", "watch") and settings["pulse_start"] is None:
+        parser.error("the start of the light pulse is needed (--pulse-start or pulse_start in --config)")
+    if args.command in STEP_COMMANDS:
+        run_command(args.command, args.video_root, settings, args.force)
+    elif args.command == "watch":
+        try:
+            watch(args.video_root, settings, args.interval, args.settle)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+    elif args.command == "live":
+        try:
+            live(live_source(args, settings), settings, args.queue, args.output)
+        except KeyboardInterrupt:
+            print("Stopped.")
+
+
+if __name__ == "__main__":
+    freeze_support()
+    main()
@@ -0,0 +1,1924 @@
+from os import walk, getpid, replace, remove
+from os.path import join, exists, getmtime, getsize, basename, dirname, relpath
+from collections import deque, OrderedDict
+from glob import glob, escape
+from pickle import load as pickle_load, dump as pickle_dump
+from itertools import islice
+from struct import unpack
+from zipfile import ZipFile
+from zlib import compress, decompress
+from heapq import heappush, heappop
+from hashlib import blake2b
+from json import load as json_load, dump as json_dump, loads as json_loads, dumps as json_dumps
+from math import sqrt, inf, sin
+from concurrent.futures import ProcessPoolExecutor, as_completed, Future
+from threading import Thread, Condition
+from time import time, sleep
+from multiprocessing import get_context
+from imageio_ffmpeg import read_frames as ffmpeg_frames
+from numpy.random import default_rng
+from numpy import packbits, unpackbits, stack, uint32, arange, bincount, cumsum, argmax, take_along_axis, \
+    where, minimum, maximum, median, float32, load, savez, frombuffer, uint8, memmap, zeros, \
+    array, int64, ones, nonzero, around, atleast_1d, asarray, pad
+from numpy.lib.format import read_magic, read_array_header_1_0, read_array_header_2_0, read_array
+
+from warnings import filterwarnings
+from logging import getLogger, ERROR
+
+
+"""
+-----
+WormRuler processing functions
+
+Per-frame and per-video processing steps of WormRuler without any GUI code, so they can be
+run in worker processes. Settings are passed as a dictionary (see DEFAULT_SETTINGS).
+Heavy libraries (skimage, scipy, fil_finder and astropy, pandas, imageio) are imported by the functions
+which use them, so a step only loads what it needs and the module imports quickly.
+-----
+"""
+
+# Ignore warnings
+filterwarnings('ignore', '.*No beam width given.*', )
+filterwarnings('ignore', '.*Graph pruning reached max iterations.*', )
+# cropped and downscaled frames are expected to differ from the size of the video
+getLogger('imageio_ffmpeg').setLevel(ERROR)
+
+# settings used by the processing functions
+DEFAULT_SETTINGS = {
+    "gamma": 1.0,          # gamma value for background correction
+    "framerate": 30,       # framerate of videos and GIFs (fps)
+    "roi": None,           # ROI (x, y, width, height) from *_ROI.txt
+    "save_gifs": True,     # write *_bw.gif and *_skel.gif in fused processing
+    "workers": 1,          # number of videos processed in parallel
+    "chunk_frames": 500,   # videos are split into chunks of this many frames (several workers, checkpoint)
+    "batch_frames": 0,     # frames thresholded together in one block (0: frame by frame)
+    "segmentation": "otsu",  # "otsu": threshold per frame, "background": subtraction of median background
+    "cleanup": "morphology",  # "morphology": remove small objects and holes, "largest": clean up only the worm
+    "kernels": "skimage",  # "numba": thinning and morphology compiled by numba (skimage if numba is missing)
+    "background_samples": 25,  # frames used for the median background
+    "downscale": 1,        # raw videos are downscaled by this factor while decoding (1: full resolution)
+    "crop_first": False,   # crop raw videos to the ROI before background correction (ROI has to be set first)
+    "skeleton_engine": "filfinder",  # "filfinder", "native" (skeleton graph of this module) or "parity" (both)
+    "tracking": False,     # skeletonize only the bounding box of the worm in the previous frame
+    "tracking_margin": 20,  # margin (pixels) around the bounding box of the worm
+    "memo_frames": 64,     # results of this many different frames are reused for identical frames (0: off)
+    "checkpoint": False,   # save finished chunks of chunk_frames frames, interrupted videos continue from them
+    "pipeline_frames": 8,  # frames waiting between decoding, processing and writing of a video (0: one thread)
+    "abort_unusable": False,  # stop skeletonization of videos which can not pass the 50% rule of data analysis
+    "pulse_start": None,   # start of the light pulse (s), lengths are normalized to the average before it
+    "lower_bound": 0.8,    # normalized lengths outside (lower_bound, upper_bound) are removed
+    "upper_bound": 1.2,
+}
+
+
+# Function to crop an image to the ROI (x, y, width, height) stored in *_ROI.txt
+def crop_roi(img, roi):
+    a, b, c, d = roi
+    return img[int(b):int(b + d), int(a):int(a + c)]
+
+
+# reads ROI coordinates from a *_ROI.txt (see ExperimentIndex.roi_path)
+def read_roi_file(path):
+    textfile = open(path, "r")
+    lines = textfile.readlines()
+    roi = []
+    for line in lines:
+        line.strip(r"\n")
+        roi.append(int(line))
+    textfile.close()
+    return roi
+
+
+# raw videos are found by their file ending
+def is_video(file):
+    return ".AVI" in file or ".avi" in file or ".mov" in file or ".MOV" in file
+
+
+# files of an experiment found in a single scan of the video root
+# conditions are the subfolders of the video root, their raw videos and derived files (*_bw.npz, *_raw_lengths.txt,
+# *_data.txt, ...) are looked up in the index instead of searching the tree again,
+# files written by a stage are added with add so later stages find them
+class ExperimentIndex(object):
+
+    def __init__(self, video_root):
+        self.root = video_root
+        self.conditions = []
+        # condition -> paths of its files (including subfolders), None for files in the video root
+        self.files = OrderedDict([(None, [])])
+        self.paths = set()
+        for r, d, f in walk(video_root):
+            condition = self.condition(r)
+            if condition is None:
+                self.conditions = list(d)
+                for folder in d:
+                    self.files[folder] = []
+            for file in f:
+                self.add(join(r, file), condition)
+
+    # condition of a folder in the video root, None for the video root
+    def condition(self, folder):
+        folder = relpath(folder, self.root).replace("\\", "/")
+        if folder == ".":
+            return None
+        return folder.split("/")[0]
+
+    def add(self, path, condition=False):
+        if path in self.paths:
+            return
+        if condition is False:
+            condition = self.condition(dirname(path))
+        self.files.setdefault(condition, []).append(path)
+        self.paths.add(path)
+
+    # paths of the files of condition (of all conditions if None) whose name passes test
+    def find(self, test, condition=None):
+        if condition is None:
+            paths = [path for condition in self.conditions for path in self.files[condition]]
+        else:
+            paths = self.files.get(condition, [])
+        return [path for path in paths if test(basename(path))]
+
+    def videos(self, condition=None):
+        return self.find(is_video, condition)
+
+    # background corrected videos, *_bw.gif of older versions only if there is no *_bw.npz of the same video
+    def masks(self, condition=None):
+        return [path for path in self.find(lambda file: "_bw.npz" in file or "_bw.gif" in file, condition)
+                if "_bw.npz" in basename(path) or path[:-4] + ".npz" not in self.paths]
+
+    def raw_lengths(self, condition=None):
+        return self.find(lambda file: "_raw_lengths.txt" in file, condition)
+
+    def data(self, condition=None):
+        return self.find(lambda file: "_data.txt" in file, condition)
+
+    # first *_ROI.txt of the experiment, usually in the video root
+    def roi_path(self):
+        return [path for files in self.files.values() for path in files if path.endswith("_ROI.txt")][0]
+
+    # outputs of a per-video function written for video_paths
+    def add_outputs(self, function, video_paths):
+        for v_path in video_paths:
+            if exists(output_path(function, v_path)):
+                self.add(output_path(function, v_path))
+
+
+# factor of the integer grayscale values of threshold_frames, bin edges of the histograms are computed exactly
+GRAY_SCALE = 10000
+
+
+# grayscale image (0 to 1) of an RGB frame or of a frame decoded to grayscale by ffmpeg
+def gray_frame(image):
+    from skimage import color
+    if image.ndim == 3:
+        return color.rgb2gray(image)
+    return image / 255
+
+
+# ROI (x, y, width, height) in frames downscaled by scale
+def scale_roi(roi, scale):
+    return [int(value) // scale for value in roi]
+
+
+# smallest object (worm) and largest hole (pixels at full resolution) kept by clean_binary
+MIN_OBJECT_SIZE = 2000
+MAX_HOLE_SIZE = 700
+
+
+# close holes, remove small objects
+# object and hole sizes are given for full resolution and reduced for frames downscaled by scale
+# cleanup "largest" keeps only the worm (see worm_components)
+def clean_binary(binary, scale=1, cleanup="morphology", kernels="skimage"):
+    from skimage.morphology import remove_small_holes, remove_small_objects, closing
+    if cleanup == "largest":
+        return worm_components(binary, scale)
+    if kernels == "numba" and jit_kernels() is not None:
+        return jit_kernels().clean_binary(binary, MIN_OBJECT_SIZE // scale ** 2, MAX_HOLE_SIZE // scale ** 2)
+    binary = remove_small_objects(binary, min_size=MIN_OBJECT_SIZE // scale ** 2)
+    binary = closing(binary)
+    binary = remove_small_holes(binary, area_threshold=MAX_HOLE_SIZE // scale ** 2)
+    return binary
+
+
+# keeps the objects of a binary frame which are at least MIN_OBJECT_SIZE large (the worm, which thresholding
+# can split into two parts, see worm_length), closes them and fills their small holes
+# the frame is labelled once, closing and hole filling only process the joint bounding box of these objects
+# frames without such an object are empty
+def worm_components(binary, scale=1):
+    from scipy.ndimage import label, find_objects, binary_closing
+    worm = zeros(binary.shape, bool)
+    labels, count = label(binary)
+    if count == 0:
+        return worm
+    sizes = bincount(labels.ravel())
+    keep = sizes >= MIN_OBJECT_SIZE // scale ** 2
+    keep[0] = False
+    if not keep.any():
+        return worm
+    boxes = [box for box, kept in zip(find_objects(labels), keep[1:]) if kept]
+    rows = slice(min(box[0].start for box in boxes), max(box[0].stop for box in boxes))
+    cols = slice(min(box[1].start for box in boxes), max(box[1].stop for box in boxes))
+    # the margin keeps the closed worm away from the border of the box (closing stays inside the bounding box)
+    box = binary_closing(pad(keep[labels[rows, cols]], 2))
+    # holes are the background regions inside the worm, the background around it touches the margin
+    holes, count = label(~box)
+    small = bincount(holes.ravel()) < MAX_HOLE_SIZE // scale ** 2
+    small[0] = False
+    small[holes[0, 0]] = False
+    box |= small[holes]
+    worm[rows, cols] = box[2:-2, 2:-2]
+    return worm
+
+
+# module wormruler_kernels (kernels compiled by numba), None if numba can not be imported
+# skimage is used instead and a message is printed once per process
+JIT_KERNELS = {}
+
+
+def jit_kernels():
+    if "module" not in JIT_KERNELS:
+        try:
+            import wormruler_kernels
+            JIT_KERNELS["module"] = wormruler_kernels
+        except ImportError as error:
+            print("Kernels of numba are not available (" + str(error) + "), skimage is used instead.")
+            JIT_KERNELS["module"] = None
+    return JIT_KERNELS["module"]
+
+
+# compares the numba kernels with skimage on the frames of background corrected videos (*_bw.npz or *_bw.gif):
+# thinning of every frame and cleanup of the frame with 2% of its pixels flipped (small objects and holes)
+# prints the differing pixels and times per video, returns True if all results are the same
+def check_kernels(video_paths, frames=None):
+    from skimage.morphology import thin
+    kernels = jit_kernels()
+    if kernels is None:
+        return False
+    # compiles the kernels before they are timed
+    kernels.thin(zeros((3, 3), bool))
+    kernels.clean_binary(zeros((3, 3), bool), 1, 1)
+    rng = default_rng(0)
+    same = True
+    for v_path in video_paths:
+        differences = [0, 0]
+        times = [0.0, 0.0]
+        count = 0
+        for binary in read_binaries(v_path, stop=frames):
+            noisy = binary ^ (rng.random(binary.shape) < 0.02)
+            start = time()
+            thin_skimage = thin(binary)
+            clean_skimage = clean_binary(noisy)
+            middle = time()
+            thin_numba = kernels.thin(binary)
+            clean_numba = kernels.clean_binary(noisy, MIN_OBJECT_SIZE, MAX_HOLE_SIZE)
+            end = time()
+            differences[0] += int((thin_skimage != thin_numba).sum())
+            differences[1] += int((clean_skimage != clean_numba).sum())
+            times[0] += middle - start
+            times[1] += end - middle
+            count += 1
+        same = same and differences == [0, 0]
+        print("%s: %d frames, differing pixels: thinning %d, cleanup %d, skimage %.1f ms, numba %.1f ms per frame" %
+              (v_path, count, differences[0], differences[1], 1000 * times[0] / max(count, 1),
+               1000 * times[1] / max(count, 1)))
+    return same
+
+
+# converts a video frame to grayscale, subtracts background and returns binary image of the worm
+def binarize_frame(image, Gamma_value, scale=1, cleanup="morphology", kernels="skimage"):
+    from skimage.filters import threshold_otsu
+    from skimage.util import invert
+    # convert to grayscale
+    img = gray_frame(image)
+
+    # get threshold and make binary
+    otsu = threshold_otsu(img)
+    binary = img > otsu * Gamma_value
+    binary = invert(binary)
+    return clean_binary(binary, scale, cleanup, kernels)
+
+
+# thresholds a block of grayscale frames (n, height, width) decoded by ffmpeg at once and returns the binary stack
+# 256-bin histograms and Otsu thresholds of all frames are computed together on integer grayscale values
+# (gray x GRAY_SCALE), results only differ from binarize_frame for pixels rounding onto a histogram bin edge
+def threshold_frames(block, Gamma_value, nbins=256):
+    n = block.shape[0]
+    gray = block * uint32(GRAY_SCALE)
+    pixels = gray.reshape(n, -1)
+
+    # histogram of every frame with nbins bins between its minimum and maximum
+    low = pixels.min(axis=1)[:, None]
+    high = pixels.max(axis=1)[:, None]
+    span = maximum(high - low, 1)
+    index = minimum((pixels - low) * uint32(nbins) // span, nbins - 1)
+    index += arange(n, dtype=uint32)[:, None] * uint32(nbins)
+    counts = bincount(index.ravel(), minlength=n * nbins).reshape(n, nbins)
+    centers = low + (arange(nbins) + 0.5) * span / nbins
+
+    # Otsu threshold of every frame (see skimage.filters.threshold_otsu)
+    weight1 = cumsum(counts, axis=1)
+    weight2 = cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    mean1 = cumsum(counts * centers, axis=1) / weight1
+    mean2 = (cumsum((counts * centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+    variance12 = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+    otsu = take_along_axis(centers, argmax(variance12, axis=1)[:, None], axis=1)
+    # frames with a single grey value are thresholded at this value
+    otsu = where(high == low, low, otsu)
+
+    # worm is darker than threshold (inverted binary)
+    return gray <= (otsu * Gamma_value)[:, :, None]
+
+
+# background image of a video for segmentation by background subtraction
+# temporal median of background_samples frames spread over the video, the worm has to move between them
+# returns the background and the intensity ratio (frame / background) below which pixels belong to the worm
+# (Otsu threshold of the ratios of the sampled frames), both are cached next to the video as *_background.npz
+# the cache is rebuilt if the video or the settings it depends on (samples, downscale, ROI crop) changed
+def background_model(v_path, settings):
+    from skimage.filters import threshold_otsu
+    samples = int(settings["background_samples"])
+    scale = int(settings["downscale"])
+    roi = frame_roi(settings)
+    key = [samples, scale] + (list(roi) if roi is not None else [])
+
+    cache_path = v_path[:-4] + "_background.npz"
+    if exists(cache_path) and getmtime(cache_path) >= getmtime(v_path):
+        cache = load(cache_path)
+        if cache["key"].tolist() == key:
+            return cache["background"], float(cache["ratio"])
+
+    step = max(1, estimate_frames(v_path) // samples)
+    frames = read_frames(v_path, step=step, gray=True, roi=roi, scale=scale)
+    frames = stack([gray_frame(image).astype(float32) for image in islice(frames, samples)])
+    background = maximum(median(frames, axis=0), 1 / 255)
+    # pixels brighter than the background are clipped, they can not belong to the worm
+    ratio = float(threshold_otsu(minimum(frames / background, 1)))
+
+    # write to temporary file first, several workers may build the same background
+    temp_path = cache_path[:-4] + "_%d.tmp.npz" % getpid()
+    savez(temp_path, background=background, ratio=ratio, key=key)
+    replace(temp_path, cache_path)
+    return background, ratio
+
+
+# binary images of the worm for a sequence of frames
+# segmentation "otsu": per-frame Otsu threshold scaled by gamma,
+#   with batch_frames > 1, frames are read in blocks and thresholded together (see threshold_frames)
+# segmentation "background": pixels darker than background * ratio * gamma (see background_model)
+def binarize_frames(frames, settings, background=None):
+    scale = int(settings["downscale"])
+    if settings["segmentation"] == "background":
+        background, ratio = background
+        limit = background * (ratio * settings["gamma"])
+        for image in frames:
+            yield clean_binary(gray_frame(image) <= limit, scale, settings["cleanup"], settings["kernels"])
+        return
+
+    batch_frames = int(settings["batch_frames"])
+    if batch_frames > 1:
+        while True:
+            block = list(islice(frames, batch_frames))
+            if not block:
+                break
+            for binary in threshold_frames(stack(block), settings["gamma"]):
+                yield clean_binary(binary, scale, settings["cleanup"], settings["kernels"])
+    else:
+        for image in frames:
+            yield binarize_frame(image, settings["gamma"], scale, settings["cleanup"], settings["kernels"])
+
+
+# ROI to which raw video frames are cropped while decoding (None: full frames)
+# with crop_first, thresholding, morphology and *_bw.gif only cover the ROI
+def frame_roi(settings):
+    if settings["crop_first"]:
+        return settings["roi"]
+    return None
+
+
+# binary images of the worm for frames [start, stop) of a raw video
+# frames are decoded to grayscale (cropped and downscaled) by ffmpeg
+def video_binaries(v_path, settings, start=0, stop=None):
+    background = None
+    if settings["segmentation"] == "background":
+        background = background_model(v_path, settings)
+    frames = read_frames(v_path, start, stop, gray=True, roi=frame_roi(settings), scale=int(settings["downscale"]))
+    return binarize_frames(pipelined(frames, settings), settings, background)
+
+
+# minimum size (pixels) of skeletons and length of side branches which are kept by the skeleton analysis
+SKEL_THRESH = 10
+BRANCH_THRESH = 5
+
+# steps to the 8 neighbours of a pixel and their lengths
+NEIGHBOURS = [(dy, dx, sqrt(2) if dy and dx else 1.0) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+
+
+# lengths of the longest paths of all skeletons in a thinned image and image of these paths, measured by FilFinder
+# lengths are rounded to 8 decimals like the printed lengths read by earlier versions
+def filfinder_lengths(skel):
+    from fil_finder import FilFinder2D
+    from astropy.units import pix, pc
+    fil = FilFinder2D(skel, distance=250 * pc, mask=skel)
+    fil.medskel(verbose=False)
+    fil.analyze_skeletons(branch_thresh=BRANCH_THRESH * pix, skel_thresh=SKEL_THRESH * pix, prune_criteria='length')
+    skel_fil = fil.skeleton_longpath
+    skel_lengths = around(atleast_1d(fil.lengths(unit=pix).to_value(pix)), 8)
+    return skel_lengths, skel_fil
+
+
+# pixel adjacency graph of a skeleton {pixel: {neighbour: distance}} with 8-connectivity
+# diagonal neighbours are not connected if they share a horizontal or vertical neighbour,
+# so corners of the skeleton are not cut short
+def skeleton_graph(pixels):
+    pixels = set(pixels)
+    graph = {}
+    for y, x in pixels:
+        edges = {}
+        for dy, dx, distance in NEIGHBOURS:
+            neighbour = (y + dy, x + dx)
+            if neighbour not in pixels:
+                continue
+            if dy and dx and ((y + dy, x) in pixels or (y, x + dx) in pixels):
+                continue
+            edges[neighbour] = distance
+        graph[(y, x)] = edges
+    return graph
+
+
+# removes side branches (end pixel up to the next junction) shorter than branch_thresh from a skeleton graph
+# repeated until no branch is shorter, as removing a branch can turn a junction into part of a longer branch
+def prune_branches(graph, branch_thresh):
+    pruned = True
+    while pruned:
+        pruned = False
+        for end in [pixel for pixel, edges in graph.items() if len(edges) == 1]:
+            if end not in graph or len(graph[end]) != 1:
+                continue
+            branch = [end]
+            length = 0.0
+            previous, pixel = None, end
+            while True:
+                following = [neighbour for neighbour in graph[pixel] if neighbour != previous]
+                length += graph[pixel][following[0]]
+                previous, pixel = pixel, following[0]
+                if len(graph[pixel]) != 2:
+                    break
+                branch.append(pixel)
+            # only branches ending in a junction are side branches
+            if len(graph[pixel]) > 2 and length < branch_thresh:
+                for branch_pixel in branch:
+                    for neighbour in graph.pop(branch_pixel):
+                        if neighbour in graph:
+                            del graph[neighbour][branch_pixel]
+                pruned = True
+
+
+# distances from start to all pixels of a skeleton graph and the previous pixel on each shortest path
+def shortest_paths(graph, start):
+    distances = {start: 0.0}
+    previous = {start: None}
+    queue = [(0.0, start)]
+    while queue:
+        distance, pixel = heappop(queue)
+        if distance > distances[pixel]:
+            continue
+        for neighbour, step in graph[pixel].items():
+            if distance + step < distances.get(neighbour, inf):
+                distances[neighbour] = distance + step
+                previous[neighbour] = pixel
+                heappush(queue, (distance + step, neighbour))
+    return distances, previous
+
+
+# longest of the shortest paths between end pixels of a skeleton graph
+# returns its length and pixels, skeletons without end pixels (closed loops) are measured from any pixel
+def longest_path(graph):
+    ends = [pixel for pixel, edges in graph.items() if len(edges) <= 1]
+    if not ends:
+        ends = [next(iter(graph))]
+    best_length, best_end, best_previous = -1.0, None, None
+    for start in ends:
+        distances, previous = shortest_paths(graph, start)
+        end = max(distances, key=distances.get)
+        if distances[end] > best_length:
+            best_length, best_end, best_previous = distances[end], end, previous
+    path = []
+    pixel = best_end
+    while pixel is not None:
+        path.append(pixel)
+        pixel = best_previous[pixel]
+    return best_length, path
+
+
+# lengths of the longest paths of all skeletons in a thinned image and image of these paths
+# measured on the pixel graph of each skeleton (straight steps 1, diagonal steps sqrt(2)),
+# skeletons and side branches are removed with the same thresholds as in the FilFinder analysis
+def native_lengths(skel):
+    from scipy.ndimage import label, find_objects
+    labels, count = label(skel, structure=ones((3, 3)))
+    skel_path = zeros(skel.shape, bool)
+    lengths = []
+    for num, window in enumerate(find_objects(labels), 1):
+        rows, cols = nonzero(labels[window] == num)
+        if len(rows) < SKEL_THRESH:
+            continue
+        rows = (rows + window[0].start).tolist()
+        cols = (cols + window[1].start).tolist()
+        graph = skeleton_graph(zip(rows, cols))
+        prune_branches(graph, BRANCH_THRESH)
+        length, path = longest_path(graph)
+        lengths.append(length)
+        skel_path[tuple(zip(*path))] = True
+    return lengths, skel_path
+
+
+# length of the worm from the lengths (array) of all skeletons in the image
+# a worm can be split into two skeletons, None if there is no or more than two skeletons
+def worm_length(lengths):
+    lengths = asarray(lengths, float)
+    if 1 <= lengths.size <= 2:
+        return float(lengths.sum())
+    return None
+
+
+# thins binary worm image and measures length of the longest skeleton path
+# returns length (None if no or more than two skeletons were found), skeleton image and parity length
+# engine "filfinder": FilFinder2D, skeleton image is None if FilFinder failed
+# engine "native": skeleton graph analysis of this module (see native_lengths)
+# engine "parity": length and skeleton image from FilFinder, parity length from the native engine
+# kernels "numba": thinning compiled by numba
+def measure_skeleton(binary, engine="filfinder", kernels="skimage"):
+    from skimage.morphology import thin
+    from skimage.util import img_as_ubyte
+    if kernels == "numba" and jit_kernels() is not None:
+        skel = jit_kernels().thin(binary)
+    else:
+        skel = thin(binary)
+    parity_length = None
+    if engine != "filfinder":
+        lengths, skel_path = native_lengths(skel)
+        if engine == "native":
+            return worm_length(lengths), img_as_ubyte(skel_path), None
+        parity_length = worm_length(lengths)
+    try:
+        lengths, skel_fil = filfinder_lengths(skel)
+        return worm_length(lengths), img_as_ubyte(skel_fil), parity_length
+    except:
+        return None, None, parity_length
+
+
+# measures the skeletons of consecutive frames, with tracking only inside the bounding box of the worm
+# in the previous frame enlarged by tracking_margin pixels
+# the whole frame is measured again if the worm touches the border of the box or no valid length was found,
+# objects outside the box are ignored while the worm is tracked
+# results of the last memo_frames different images are kept, repeated images (resting worms) are not measured again
+class WormTracker(object):
+
+    def __init__(self, settings):
+        self.engine = settings["skeleton_engine"]
+        self.kernels = settings["kernels"]
+        self.tracking = settings["tracking"]
+        self.margin = int(settings["tracking_margin"])
+        self.window = None
+        self.memo_frames = int(settings["memo_frames"])
+        self.memo = OrderedDict()
+
+    def measure(self, binary):
+        if not self.tracking:
+            return self.measure_image(binary)
+        if self.window is not None and self.inside_window(binary):
+            result = self.measure_window(binary, self.window)
+            if result[0] is not None:
+                return result
+        return self.measure_window(binary, (slice(0, binary.shape[0]), slice(0, binary.shape[1])))
+
+    # True if the worm in the box does not touch a border of the box which is not a border of the frame
+    def inside_window(self, binary):
+        rows, cols = self.window
+        part = binary[self.window]
+        if not part.any():
+            return False
+        height, width = binary.shape
+        return not ((rows.start > 0 and part[0].any()) or (rows.stop < height and part[-1].any()) or
+                    (cols.start > 0 and part[:, 0].any()) or (cols.stop < width and part[:, -1].any()))
+
+    def measure_window(self, binary, window):
+        part = binary[window]
+        length, skel_image, parity_length = self.measure_image(part)
+        if self.tracking:
+            self.update_window(part, window)
+            if skel_image is not None and skel_image.shape != binary.shape:
+                full_image = zeros(binary.shape, uint8)
+                full_image[window] = skel_image
+                skel_image = full_image
+        return length, skel_image, parity_length
+
+    # measures a binary image or reuses the result of an identical image (same size and hash of the pixels)
+    # skeleton images are kept bit-packed (1 bit per pixel instead of 1 byte)
+    def measure_image(self, binary):
+        from skimage.util import img_as_ubyte
+        if self.memo_frames <= 0:
+            return measure_skeleton(binary, self.engine, self.kernels)
+        key = (binary.shape, blake2b(packbits(binary).tobytes(), digest_size=16).digest())
+        saved = self.memo.get(key)
+        if saved is None:
+            result = measure_skeleton(binary, self.engine, self.kernels)
+            self.memo[key] = (result[0], pack_image(result[1]), result[2])
+            if len(self.memo) > self.memo_frames:
+                self.memo.popitem(last=False)
+            return result
+        self.memo.move_to_end(key)
+        length, skel_image, parity_length = saved
+        if skel_image is not None:
+            skel_image = img_as_ubyte(unpack_image(skel_image))
+        return length, skel_image, parity_length
+
+    # bounding box of the worm enlarged by the margin for the next frame, None if the frame was empty
+    def update_window(self, part, window):
+        rows = nonzero(part.any(axis=1))[0]
+        cols = nonzero(part.any(axis=0))[0]
+        if len(rows) == 0:
+            self.window = None
+            return
+        row_start, col_start = window[0].start, window[1].start
+        self.window = (slice(max(row_start + rows[0] - self.margin, 0), row_start + rows[-1] + self.margin + 1),
+                       slice(max(col_start + cols[0] - self.margin, 0), col_start + cols[-1] + self.margin + 1))
+
+
+# codecs which can reorder frames (B-frames), AVI files store no reliable timestamps of their frames
+REORDERING_CODECS = ("h264", "hevc", "mpeg4", "mpeg2video", "mpeg1video", "vc1")
+
+
+# time (s) of an accurate seek to frame start, None if the frame can not be found by seeking (GIFs and AVI files
+# of codecs with B-frames, all frames before the start are decoded and dropped instead)
+# a quarter frame before the start: timestamps of the start frame which are a bit early do not drop it,
+# and seek times rounded to the timebase of the video (1 / framerate in AVI files) do not keep the frame before it
+def seek_time(v_path, start):
+    from imageio import get_reader
+    if v_path.endswith(".gif"):
+        return None
+    vid = get_reader(v_path, 'ffmpeg')
+    meta = vid.get_meta_data()
+    vid.close()
+    if v_path.lower().endswith(".avi") and meta["codec"] in REORDERING_CODECS:
+        return None
+    return (start - 0.25) / meta["fps"]
+
+
+# reads frames [start, stop) of a video as uint8 arrays, only every step-th frame if step > 1
+# ffmpeg seeks to the start if possible (frames before it are only decoded from the preceding keyframe),
+# skipped frames are dropped by ffmpeg (select filter) without being sent to python
+# gray: ffmpeg converts frames to grayscale, frames are (height, width) instead of (height, width, 3)
+# roi: ffmpeg crops frames to the ROI (x, y, width, height)
+# scale: ffmpeg downscales frames (after cropping) by this factor
+def read_frames(v_path, start=0, stop=None, step=1, gray=False, roi=None, scale=1, input_params=None):
+    input_params = list(input_params or [])
+    select = []
+    first = 0
+    seek = seek_time(v_path, start) if start > 0 else None
+    if seek is not None:
+        input_params += ['-accurate_seek', '-ss', '%.6f' % seek]
+    elif start > 0:
+        select.append('gte(n\\,%d)' % start)
+        first = start
+    if step > 1:
+        select.append('not(mod(n-%d\\,%d))' % (first, step))
+    filters = []
+    if select:
+        filters.append('select=' + '*'.join(select))
+    # convert before cropping, so chroma subsampling of the video does not round the crop
+    filters.append('format=gray' if gray else 'format=rgb24')
+    if roi is not None:
+        a, b, c, d = roi
+        filters.append('crop=%d:%d:%d:%d' % (int(a + c) - int(a), int(b + d) - int(b), int(a), int(b)))
+    if scale > 1:
+        filters.append('scale=iw/%d:ih/%d:flags=area' % (scale, scale))
+
+    depth = 1 if gray else 3
+    # -vsync 0: frames dropped by select must not be replaced by duplicates to keep the framerate
+    vid = ffmpeg_frames(v_path, pix_fmt='gray' if gray else 'rgb24', bpp=depth, input_params=input_params,
+                        output_params=['-vf', ','.join(filters), '-vsync', '0'])
+    try:
+        width, height = next(vid)["size"]
+        shape = (height, width) if gray else (height, width, depth)
+        for num, frame in enumerate(vid):
+            if stop is not None and start + num * step >= stop:
+                break
+            yield frombuffer(frame, uint8).reshape(shape)
+    finally:
+        vid.close()
+
+
+# estimates the number of frames of a video from duration and framerate in its header
+# the number of frames of a *_bw.npz file is exact
+def estimate_frames(v_path):
+    from imageio import get_reader
+    if v_path.endswith(".npz"):
+        return len(open_masks(v_path)[1]) - 1
+    vid = get_reader(v_path, 'ffmpeg')
+    meta = vid.get_meta_data()
+    vid.close()
+    return int(round(meta.get("duration", 0) * meta.get("fps", 0)))
+
+
+# frame size (width, height) of a video or *_bw.npz file
+def video_size(v_path):
+    from imageio import get_reader
+    if v_path.endswith(".npz"):
+        height, width = open_masks(v_path)[2]
+        return width, height
+    vid = get_reader(v_path, 'ffmpeg')
+    size = vid.get_meta_data()["size"]
+    vid.close()
+    return tuple(size)
+
+
+# background corrected frames are stored bit-packed in *_bw.npz (numpy archive without zip compression):
+# "frames": frames packed along the rows (8 pixels per byte) and compressed one by one with zlib
+# "offsets": start of every frame in "frames" (number of frames + 1), "shape": height and width of the frames,
+# "scale": factor by which the frames are downscaled from the raw video (see mask_scale)
+# frames are written to a temporary file first, the number of frames is only known at the end
+class MaskWriter(object):
+
+    def __init__(self, path, scale=1):
+        self.path = path
+        self.scale = scale
+        self.temp_path = path + ".tmp"
+        self.temp = open(self.temp_path, "wb")
+        self.shape = (0, 0)
+        self.offsets = [0]
+
+    def append_data(self, binary):
+        self.shape = binary.shape
+        data = compress(packbits(binary, axis=-1).tobytes(), 1)
+        self.temp.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.temp.close()
+        if self.offsets[-1] > 0:
+            frames = memmap(self.temp_path, uint8, 'r')
+        else:
+            frames = zeros(0, uint8)
+        savez(self.path, frames=frames, offsets=array(self.offsets, int64), shape=array(self.shape, int64),
+              scale=array(self.scale, int64))
+        del frames
+        remove(self.temp_path)
+
+    def abort(self):
+        self.temp.close()
+        remove(self.temp_path)
+
+
+# memory map of an array in a numpy archive which was written without compression
+def map_member(path, archive, name):
+    info = archive.getinfo(name + ".npy")
+    with open(path, "rb") as f:
+        # array data starts after the local file header of the archive member and the .npy header
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = unpack("<HH", f.read(4))
+        f.seek(name_length + extra_length, 1)
+        if read_magic(f) == (1, 0):
+            shape, fortran_order, dtype = read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = read_array_header_2_0(f)
+        offset = f.tell()
+    if shape[0] == 0:
+        return zeros(shape, dtype)
+    return memmap(path, dtype, 'r', offset, shape)
+
+
+# opens a *_bw.npz file, frames are only read from disk when they are used
+# returns the compressed frames (memory map), the frame offsets and the frame shape (height, width)
+def open_masks(path):
+    with ZipFile(path) as archive:
+        with archive.open("offsets.npy") as f:
+            offsets = read_array(f)
+        with archive.open("shape.npy") as f:
+            shape = tuple(int(value) for value in read_array(f))
+        frames = map_member(path, archive, "frames")
+    return frames, offsets, shape
+
+
+# factor by which background corrected frames are downscaled from the raw video
+# *_bw.npz written without "scale" and *_bw.gif (always written at full resolution) are not downscaled
+def mask_scale(path):
+    if not path.endswith(".npz"):
+        return 1
+    with ZipFile(path) as archive:
+        if "scale.npy" not in archive.namelist():
+            return 1
+        with archive.open("scale.npy") as f:
+            return int(read_array(f))
+
+
+# reads frames [start, stop) of a *_bw.npz file as boolean images, cropped to the ROI (x, y, width, height)
+# rows outside the ROI are not unpacked
+def read_masks(path, start=0, stop=None, roi=None):
+    frames, offsets, shape = open_masks(path)
+    height, width = shape
+    for num in range(len(offsets) - 1)[start:stop]:
+        packed = frombuffer(decompress(frames[offsets[num]:offsets[num + 1]]), uint8).reshape(height, -1)
+        if roi is None:
+            yield unpackbits(packed, axis=-1, count=width).view(bool)
+        else:
+            a, b, c, d = roi
+            binary = unpackbits(packed[int(b):int(b + d)], axis=-1, count=width).view(bool)
+            yield binary[:, int(a):int(a + c)]
+
+
+# reads frames [start, stop) of background corrected frames (*_bw.npz or *_bw.gif of older versions)
+# as boolean images cropped to the ROI
+def read_binaries(path, start=0, stop=None, roi=None):
+    if path.endswith(".npz"):
+        return read_masks(path, start, stop, roi)
+    # ffmpeg crops *_bw.gif frames to the ROI and converts them to grayscale
+    return (frame > 127 for frame in read_frames(path, start, stop, gray=True, roi=roi))
+
+
+# per-frame results (length, background corrected image, skeleton image, parity length) of the processing steps
+# for frames [start, stop) of a video
+
+# background correction of raw video frames
+def correct_results(v_path, settings, start=0, stop=None):
+    for binary in video_binaries(v_path, settings, start, stop):
+        yield None, binary, None, None
+
+
+# converts a length measured in downscaled frames to pixels of the full resolution video
+def scale_length(length, scale):
+    if length is None:
+        return None
+    return length * scale
+
+
+# skeletonization of background corrected frames (*_bw.npz or *_bw.gif)
+# the ROI and lengths are scaled by the factor the frames were written with, not by the current settings
+# frames written with crop_first already have the size of the ROI (up to rounding) and are not cropped again
+def skeleton_results(v_path, settings, start=0, stop=None):
+    scale = mask_scale(v_path)
+    roi = scale_roi(settings["roi"], scale)
+    width, height = video_size(v_path)
+    if width <= roi[2] and height <= roi[3]:
+        roi = None
+    tracker = WormTracker(settings)
+    for binary in pipelined(read_binaries(v_path, start, stop, roi), settings):
+        length, skel_fil_gif, parity_length = tracker.measure(binary)
+        yield scale_length(length, scale), None, skel_fil_gif, scale_length(parity_length, scale)
+
+
+# background correction and skeletonization of raw video frames in a single pass
+# every frame is decoded once and stays in memory: threshold -> morphology -> ROI crop -> skeleton -> length
+def fused_results(v_path, settings, start=0, stop=None):
+    scale = int(settings["downscale"])
+    roi = scale_roi(settings["roi"], scale)
+    tracker = WormTracker(settings)
+    for binary in video_binaries(v_path, settings, start, stop):
+        if settings["crop_first"]:
+            length, skel_fil_gif, parity_length = tracker.measure(binary)
+        else:
+            length, skel_fil_gif, parity_length = tracker.measure(crop_roi(binary, roi))
+        yield scale_length(length, scale), binary, skel_fil_gif, scale_length(parity_length, scale)
+
+
+# buffer size (bytes) of *_raw_lengths.txt, lengths of several thousand frames are written at once
+LENGTHS_BUFFER = 1 << 16
+
+
+# line of *_raw_lengths.txt for the length of one frame ("None" if no valid length was found)
+def format_length(length):
+    if length is None:
+        return "None\n"
+    return repr(float(length)) + "\n"
+
+
+# compares per-frame lengths of FilFinder and the native skeleton engine of one video
+# writes *_parity.txt (frame, FilFinder length, native length, difference) and prints a summary
+class ParityReport(object):
+
+    def __init__(self, path, name):
+        self.name = name
+        self.parity_txt = open(path, "w")
+        self.parity_txt.write("frame\tfilfinder\tnative\tdifference\n")
+        self.frames = 0
+        self.mismatches = 0
+        self.differences = []
+
+    def append(self, length, parity_length):
+        difference = None
+        if length is not None and parity_length is not None:
+            difference = parity_length - length
+            self.differences.append(abs(difference))
+        elif length is not None or parity_length is not None:
+            # only one of the engines found a valid worm
+            self.mismatches += 1
+        self.parity_txt.write("%d\t%s\t%s\t%s\n" % (self.frames, length, parity_length, difference))
+        self.frames += 1
+
+    def close(self):
+        self.parity_txt.close()
+        summary = self.name + ": " + str(self.frames) + " frames, " + \
+            str(self.mismatches) + " valid in only one engine"
+        if self.differences:
+            summary += ", mean difference %.2f px, max difference %.2f px" % \
+                (sum(self.differences) / len(self.differences), max(self.differences))
+        print("Skeleton parity " + summary)
+
+
+# writes per-frame results of one video to *_raw_lengths.txt, *_bw.npz (bw), *_bw.gif (bw_gif), *_skel.gif
+# and *_parity.txt (parity), path_root is the video path without file ending
+# files are written as *.tmp.* and only renamed when all frames were written,
+# so an interrupted run does not leave files which look complete
+class VideoOutput(object):
+
+    def __init__(self, path_root, settings, lengths=False, bw=False, bw_gif=False, skel=False, parity=False):
+        from imageio import get_writer
+        self.skel_txt = None
+        self.bw_writer = None
+        self.mask_writer = None
+        self.skel_writer = None
+        self.parity = None
+        self.scale = int(settings["downscale"])
+        self.renames = []
+        if lengths:
+            self.skel_txt = open(self.temp_path(path_root + "_raw_lengths.txt"), "w", buffering=LENGTHS_BUFFER)
+        if parity:
+            self.parity = ParityReport(self.temp_path(path_root + "_parity.txt"), basename(path_root))
+        if bw:
+            self.mask_writer = MaskWriter(self.temp_path(path_root + "_bw.npz"), self.scale)
+        if bw_gif:
+            self.bw_writer = get_writer(self.temp_path(path_root + "_bw.gif"), mode='I', fps=int(settings["framerate"]))
+        if skel:
+            self.skel_writer = get_writer(self.temp_path(path_root + "_skel.gif"), mode='I',
+                                          fps=int(settings["framerate"]))
+
+    # temporary path (*.tmp.<ending>) which is renamed to path by close
+    def temp_path(self, path):
+        temp = path[:-4] + ".tmp" + path[-4:]
+        self.renames.append((temp, path))
+        return temp
+
+    def append(self, result):
+        from skimage.util import img_as_ubyte
+        length, binary, skel_fil_gif, parity_length = result
+        if self.skel_txt is not None:
+            self.skel_txt.write(format_length(length))
+        if self.parity is not None:
+            self.parity.append(length, parity_length)
+        if self.mask_writer is not None:
+            self.mask_writer.append_data(binary)
+        # *_bw.gif is written at full resolution, as by older versions
+        if self.bw_writer is not None:
+            if self.scale > 1:
+                binary = binary.repeat(self.scale, 0).repeat(self.scale, 1)
+            self.bw_writer.append_data(img_as_ubyte(binary))
+        # frames for which FilFinder failed have no skeleton image
+        if self.skel_writer is not None and skel_fil_gif is not None:
+            self.skel_writer.append_data(img_as_ubyte(skel_fil_gif))
+
+    def close(self):
+        if self.mask_writer is not None:
+            self.mask_writer.close()
+        self.close_writers()
+        for temp, path in self.renames:
+            replace(temp, path)
+
+    # closes the files of an unfinished video and removes them
+    def abort(self):
+        if self.mask_writer is not None:
+            self.mask_writer.abort()
+        self.close_writers()
+        for temp, path in self.renames:
+            if exists(temp):
+                remove(temp)
+
+    def close_writers(self):
+        if self.skel_txt is not None:
+            self.skel_txt.close()
+        if self.bw_writer is not None:
+            self.bw_writer.close()
+        if self.skel_writer is not None:
+            self.skel_writer.close()
+        if self.parity is not None:
+            self.parity.close()
+
+
+# raised by the processing functions when a run is cancelled
+class Cancelled(Exception):
+    pass
+
+
+# cancel is an event (is_set) which stops a run between two frames, None if the run can not be cancelled
+# with several workers it has to be shared with the worker processes (multiprocessing Manager().Event())
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+# items of an iterable which are produced by a thread, at most size items wait until they are used
+# unlike FrameQueue no items are dropped, the thread waits while the queue is full
+# exceptions of the thread are raised where the item would have been used,
+# the thread stops (and closes items) when the consumer stops iterating
+class PipelineStage(object):
+
+    def __init__(self, items, size):
+        self.size = size
+        self.waiting = deque()
+        self.condition = Condition()
+        self.finished = False
+        self.stopped = False
+        self.error = None
+        self.thread = Thread(target=self.produce, args=(items,), daemon=True)
+        self.thread.start()
+
+    def produce(self, items):
+        try:
+            for item in items:
+                with self.condition:
+                    while len(self.waiting) >= self.size and not self.stopped:
+                        self.condition.wait()
+                    if self.stopped:
+                        break
+                    self.waiting.append(item)
+                    self.condition.notify_all()
+        except BaseException as error:
+            self.error = error
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def __iter__(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.waiting and not self.finished:
+                        self.condition.wait()
+                    if not self.waiting:
+                        break
+                    item = self.waiting.popleft()
+                    self.condition.notify_all()
+                yield item
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.stop()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+# decoding, processing and writing of a video run in separate threads connected by queues of
+# pipeline_frames frames, so ffmpeg, zlib and the GIF encoder (which release the GIL) overlap with the processing
+def pipelined(items, settings):
+    if int(settings["pipeline_frames"]) <= 0:
+        return items
+    return iter(PipelineStage(items, int(settings["pipeline_frames"])))
+
+
+# animals with 50% or less measured lengths are excluded by data analysis (see analyze_condition)
+# with abort_unusable, skeletonization of a video stops as soon as half of its frames have no length,
+# *_raw_lengths.txt then only contains the frames measured until then (which are excluded as well)
+# and <video>_unusable.txt reports the video
+class QualityMonitor(object):
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.measured = 0
+        self.missing = 0
+
+    # True if the video can not be used any more
+    def append(self, length):
+        self.measured += 1
+        if length is None:
+            self.missing += 1
+        return self.unusable()
+
+    def unusable(self):
+        return 2 * self.missing >= self.frames
+
+    # writes or (if the video was complete) removes <path_root>_unusable.txt
+    def report(self, path_root):
+        report_path = path_root + "_unusable.txt"
+        if not self.unusable():
+            if exists(report_path):
+                remove(report_path)
+            return
+        print("Skeletonization of " + basename(path_root) + " stopped: no length in " + str(self.missing) +
+              " of " + str(self.measured) + " frames (" + str(self.frames) + " frames at most).")
+        print("Please check gamma value and focus of this video!\n")
+        with open(report_path, "w") as report:
+            report.write("frames measured\t%d\nframes without length\t%d\nframes of video (at most)\t%d\n" %
+                         (self.measured, self.missing, self.frames))
+
+
+# QualityMonitor of a video if abort_unusable is set, None otherwise or if the number of frames is unknown
+# the number of frames of *_bw.npz files is exact, the estimate from the header of other videos is increased by 5%,
+# so a video is only stopped if it can not pass even if it is slightly longer
+def quality_monitor(v_path, settings):
+    if not settings["abort_unusable"]:
+        return None
+    frames = estimate_frames(v_path)
+    if frames <= 0:
+        return None
+    if not v_path.endswith(".npz"):
+        frames = int(frames * 1.05) + 1
+    return QualityMonitor(frames)
+
+
+# writes results of all frames of a video, the results are computed by a thread of the pipeline
+# the temporary output files are removed if the video is not finished (error or cancel)
+# a monitor (QualityMonitor) stops the video when it is unusable, the frames written until then are kept
+def write_results(output, results, settings, cancel=None, monitor=None):
+    results = pipelined(results, settings)
+    try:
+        for result in results:
+            check_cancel(cancel)
+            output.append(result)
+            if monitor is not None and monitor.append(result[0]):
+                break
+    except BaseException:
+        output.abort()
+        raise
+    finally:
+        # stops the threads of the pipeline
+        if hasattr(results, "close"):
+            results.close()
+    output.close()
+
+
+# background correction of one video, writes *_bw.npz
+def correct_video(v_path, settings, results=None, cancel=None):
+    if results is None:
+        results = correct_results(v_path, settings)
+    write_results(VideoOutput(v_path[:-4], settings, bw=True), results, settings, cancel)
+
+
+# skeletonization of one background corrected video (*_bw.npz or *_bw.gif)
+# writes *_skel.gif and raw lengths to *_raw_lengths.txt
+def skeletonize_video(v_path, settings, results=None, cancel=None):
+    if results is None:
+        results = video_results(skeletonize_video, v_path, settings, cancel)
+    parity = settings["skeleton_engine"] == "parity"
+    monitor = quality_monitor(v_path, settings)
+    write_results(VideoOutput(v_path[:-7], settings, lengths=True, skel=True, parity=parity), results, settings,
+                  cancel, monitor)
+    remove_checkpoint(skeletonize_video, v_path)
+    if monitor is not None:
+        monitor.report(v_path[:-7])
+
+
+# background correction and skeletonization of one raw video in a single pass
+# writes raw lengths to *_raw_lengths.txt, *_bw.gif and *_skel.gif only if save_gifs is set
+def process_video(v_path, settings, results=None, cancel=None):
+    if results is None:
+        results = video_results(process_video, v_path, settings, cancel)
+    save_gifs = settings["save_gifs"]
+    parity = settings["skeleton_engine"] == "parity"
+    monitor = quality_monitor(v_path, settings)
+    write_results(VideoOutput(v_path[:-4], settings, lengths=True, bw_gif=save_gifs, skel=save_gifs, parity=parity),
+                  results, settings, cancel, monitor)
+    remove_checkpoint(process_video, v_path)
+    if monitor is not None:
+        monitor.report(v_path[:-4])
+
+
+# per-video functions whose frames can be processed in chunks, with their frame results functions
+CHUNKED_FUNCTIONS = {
+    skeletonize_video: skeleton_results,
+    process_video: fused_results,
+}
+
+# number of characters removed from the video path to get the path root of the output files
+OUTPUT_ENDINGS = {
+    correct_video: len(".avi"),
+    skeletonize_video: len("_bw.gif"),
+    process_video: len(".avi"),
+}
+
+
+# binary images are sent between processes bit-packed
+def pack_image(img):
+    if img is None:
+        return None
+    return packbits(img > 0, axis=-1), img.shape
+
+
+def unpack_image(packed):
+    if packed is None:
+        return None
+    bits, shape = packed
+    return unpackbits(bits, axis=-1, count=shape[-1]).astype(bool)
+
+
+# images of the frame results (background corrected, skeleton) which are written by a per-video function
+def written_images(function, settings):
+    if function is skeletonize_video:
+        return False, True
+    return settings["save_gifs"], settings["save_gifs"]
+
+
+# results of frames [start, stop) of one video with packed images, computed in a worker process
+# images which are not written are not kept (None), so they are neither sent between processes nor saved
+def chunk_results(function, v_path, settings, start, stop, cancel=None):
+    keep_binary, keep_skel = written_images(function, settings)
+    chunk = []
+    for length, binary, skel, parity_length in CHUNKED_FUNCTIONS[function](v_path, settings, start, stop):
+        check_cancel(cancel)
+        chunk.append((length, pack_image(binary) if keep_binary else None, pack_image(skel) if keep_skel else None,
+                      parity_length))
+    return chunk
+
+
+def unpack_result(result):
+    length, binary, skel, parity_length = result
+    return length, unpack_image(binary), unpack_image(skel), parity_length
+
+
+# frame ranges [start, stop) of chunks of chunk_frames frames covering a video
+# the last chunk reads until the end of the video, estimated number of frames may be too small
+def frame_chunks(v_path, chunk_frames):
+    if chunk_frames <= 0:
+        return [(0, None)]
+    starts = list(range(0, max(estimate_frames(v_path), 1), chunk_frames))
+    stops = starts[1:] + [None]
+    return list(zip(starts, stops))
+
+
+# results of finished chunks of a video, saved as <path root>_checkpoint_<start>-<stop>.pkl while the video
+# is processed (files instead of a folder, subfolders are conditions for WormRuler)
+# the settings are saved in <path root>_checkpoint_settings.pkl, chunks computed with other settings are removed
+# files are only written when the first chunk of the video is saved, queued videos leave no files behind
+class Checkpoint(object):
+
+    def __init__(self, function, v_path, settings):
+        self.function = function
+        self.v_path = v_path
+        self.prefix = checkpoint_prefix(function, v_path)
+        self.key = {name: value for name, value in settings.items() if name not in CHECKPOINT_IGNORED}
+        self.key_path = self.prefix + "settings.pkl"
+        self.valid = None
+
+    # True if saved chunks were computed with the same settings, other chunks are removed when first checked
+    def check(self):
+        if self.valid is None:
+            self.valid = False
+            if exists(self.key_path):
+                with open(self.key_path, "rb") as f:
+                    self.valid = pickle_load(f) == self.key
+            if not self.valid:
+                remove_checkpoint(self.function, self.v_path)
+        return self.valid
+
+    def chunk_path(self, start, stop):
+        return self.prefix + "%d-%s.pkl" % (start, "end" if stop is None else stop)
+
+    # packed results of a chunk, None if it was not finished before
+    def load(self, start, stop):
+        path = self.chunk_path(start, stop)
+        if not self.check() or not exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle_load(f)
+
+    def save(self, start, stop, chunk):
+        if not self.check():
+            self.write(self.key_path, self.key)
+            self.valid = True
+        self.write(self.chunk_path(start, stop), chunk)
+
+    # write to temporary file and rename, an interrupted write does not leave a broken chunk
+    def write(self, path, data):
+        with open(path + ".tmp", "wb") as f:
+            pickle_dump(data, f)
+        replace(path + ".tmp", path)
+
+
+# settings which do not change the results of a chunk (save_gifs does, chunks only keep images which are written)
+CHECKPOINT_IGNORED = ("workers", "checkpoint", "pulse_start", "lower_bound", "upper_bound")
+
+
+def checkpoint_prefix(function, v_path):
+    return v_path[:-OUTPUT_ENDINGS[function]] + "_checkpoint_"
+
+
+# removes the checkpoint files of a video
+def remove_checkpoint(function, v_path):
+    for path in glob(escape(checkpoint_prefix(function, v_path)) + "*"):
+        remove(path)
+
+
+# frame results of a video for a per-video function
+# with checkpoint, the video is processed in chunks of chunk_frames frames, each finished chunk is saved
+# and chunks saved by an interrupted run are not processed again
+def video_results(function, v_path, settings, cancel=None):
+    if not settings["checkpoint"]:
+        return CHUNKED_FUNCTIONS[function](v_path, settings)
+    return checkpoint_results(function, v_path, settings, cancel)
+
+
+def checkpoint_results(function, v_path, settings, cancel=None):
+    checkpoint = Checkpoint(function, v_path, settings)
+    for start, stop in frame_chunks(v_path, int(settings["chunk_frames"])):
+        chunk = checkpoint.load(start, stop)
+        if chunk is None:
+            chunk = chunk_results(function, v_path, settings, start, stop, cancel)
+            checkpoint.save(start, stop, chunk)
+        for result in chunk:
+            yield unpack_result(result)
+
+
+# settings which change the output of a per-video function
+CORRECTION_SETTINGS = ("gamma", "segmentation", "background_samples", "batch_frames", "downscale", "crop_first")
+SKELETON_SETTINGS = ("roi", "downscale", "tracking", "tracking_margin")
+
+# output file of a per-video function which is tracked in the cache manifest
+CACHED_OUTPUTS = {
+    correct_video: "_bw.npz",
+    skeletonize_video: "_raw_lengths.txt",
+    process_video: "_raw_lengths.txt",
+}
+
+
+def output_path(function, v_path):
+    return v_path[:-OUTPUT_ENDINGS[function]] + CACHED_OUTPUTS[function]
+
+
+# further outputs requested by the settings, which are not tracked but computed again if missing
+def requested_outputs(function, v_path, settings):
+    endings = []
+    if function is skeletonize_video or (function is process_video and settings["save_gifs"]):
+        endings.append("_skel.gif")
+    if function is process_video and settings["save_gifs"]:
+        endings.append("_bw.gif")
+    if function in (skeletonize_video, process_video) and settings["skeleton_engine"] == "parity":
+        endings.append("_parity.txt")
+    return [v_path[:-OUTPUT_ENDINGS[function]] + ending for ending in endings]
+
+
+# settings and constants the output of a per-video function depends on
+# the ROI only matters for background correction if videos are cropped first,
+# FilFinder lengths are the same with and without parity report
+def stage_parameters(function, settings):
+    parameters = {"stage": function.__name__}
+    if function in (correct_video, process_video):
+        parameters.update({name: settings[name] for name in CORRECTION_SETTINGS})
+        parameters["clean"] = [MIN_OBJECT_SIZE, MAX_HOLE_SIZE]
+        if settings["crop_first"]:
+            parameters["roi"] = settings["roi"]
+        # outputs of the default cleanup keep the keys they were recorded with before it could be selected
+        if settings["cleanup"] != "morphology":
+            parameters["cleanup"] = settings["cleanup"]
+    if function in (skeletonize_video, process_video):
+        parameters.update({name: settings[name] for name in SKELETON_SETTINGS})
+        if settings["abort_unusable"]:
+            parameters["abort_unusable"] = True
+        parameters["engine"] = "native" if settings["skeleton_engine"] == "native" else "filfinder"
+        parameters["thresholds"] = [SKEL_THRESH, BRANCH_THRESH]
+    # compared with the values read back from the manifest
+    return json_loads(json_dumps(parameters))
+
+
+# bytes hashed at the start and at the end of an input file
+FILE_KEY_BYTES = 1 << 20
+
+
+# content key of an input file: size and hash of its first and last MiB
+# cheap for long videos and independent of the modification time, so copied experiments keep their cache
+def file_key(path):
+    size = getsize(path)
+    digest = blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(FILE_KEY_BYTES))
+        if size > 2 * FILE_KEY_BYTES:
+            f.seek(size - FILE_KEY_BYTES)
+        digest.update(f.read())
+    return "%d:%s" % (size, digest.hexdigest())
+
+
+# <root name>_cache.json in the video root, records for every output file the content key of the input
+# and the parameters it was computed with, so only missing or stale outputs have to be computed again
+# outputs written by versions without manifest are kept as they are
+class CacheManifest(object):
+
+    def __init__(self, video_root):
+        video_root = video_root.rstrip("/\\")
+        self.root = video_root
+        self.path = join(video_root, basename(video_root) + "_cache.json")
+        self.entries = {}
+        if exists(self.path):
+            with open(self.path) as f:
+                self.entries = json_load(f)
+
+    # output path relative to the video root
+    def key(self, path):
+        return relpath(path, self.root).replace("\\", "/")
+
+    # skeletons depend on the downscale factor of the background corrected frames, not on the current setting
+    def entry(self, function, v_path, settings):
+        if function is skeletonize_video:
+            settings = dict(settings, downscale=mask_scale(v_path))
+        return {"input": file_key(v_path), "parameters": stage_parameters(function, settings)}
+
+    # output of function for v_path exists and was computed from the same input with the same parameters,
+    # outputs requested by the settings (GIFs, parity report) exist as well
+    def is_current(self, function, v_path, settings):
+        path = output_path(function, v_path)
+        if not all(exists(output) for output in [path] + requested_outputs(function, v_path, settings)):
+            return False
+        entry = self.entries.get(self.key(path))
+        return entry is None or entry == self.entry(function, v_path, settings)
+
+    # videos whose outputs have to be computed, all videos with force
+    def stale(self, function, video_paths, settings, force=False):
+        return [v_path for v_path in video_paths if force or not self.is_current(function, v_path, settings)]
+
+    def record(self, function, v_path, settings):
+        path = output_path(function, v_path)
+        self.entries[self.key(path)] = self.entry(function, v_path, settings)
+        with open(self.path + ".tmp", "w") as f:
+            json_dump(self.entries, f, indent=1, sort_keys=True)
+        replace(self.path + ".tmp", self.path)
+
+
+# splits all videos into chunks of frames which are processed in parallel
+# the calling process collects the chunks of each video in order and writes the output files,
+# at most two chunks per worker are processed or waiting at the same time
+def run_chunks(function, video_paths, settings, workers, progress=None, manifest=None, finished=None, cancel=None):
+    chunk_frames = int(settings["chunk_frames"])
+    chunks = []
+    checkpoints = {}
+    for v_path in video_paths:
+        for start, stop in frame_chunks(v_path, chunk_frames):
+            chunks.append((v_path, start, stop))
+        if settings["checkpoint"]:
+            checkpoints[v_path] = Checkpoint(function, v_path, settings)
+    chunks = iter(chunks)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        # build background models once per video before its chunks are distributed
+        if function is process_video and settings["segmentation"] == "background":
+            for future in [executor.submit(background_model, v_path, settings) for v_path in video_paths]:
+                future.result()
+
+        # videos whose remaining chunks are not needed (written or stopped early, see QualityMonitor)
+        done = set()
+
+        def submit_chunks():
+            while len(pending) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                v_path, start, stop = chunk
+                if v_path in done:
+                    continue
+                saved = checkpoints[v_path].load(start, stop) if v_path in checkpoints else None
+                if saved is not None:
+                    future = Future()
+                    future.set_result(saved)
+                else:
+                    future = executor.submit(chunk_results, function, v_path, settings, start, stop, cancel)
+                pending.append((v_path, start, stop, saved is None, future))
+
+        # cancels the waiting chunks of done videos, they are always at the head of pending
+        def drop_chunks():
+            while pending and pending[0][0] in done:
+                pending.popleft()[-1].cancel()
+            submit_chunks()
+
+        def collect_results(v_path):
+            drop_chunks()
+            try:
+                while pending and pending[0][0] == v_path:
+                    v_path, start, stop, computed, future = pending.popleft()
+                    submit_chunks()
+                    chunk = future.result()
+                    if computed and v_path in checkpoints:
+                        checkpoints[v_path].save(start, stop, chunk)
+                    for result in chunk:
+                        yield unpack_result(result)
+            finally:
+                # remaining chunks of a video which was stopped early are not submitted or collected
+                done.add(v_path)
+                drop_chunks()
+
+        try:
+            for v_path in video_paths:
+                check_cancel(cancel)
+                function(v_path, settings, collect_results(v_path), cancel)
+                print(v_path)
+                if manifest is not None:
+                    manifest.record(function, v_path, settings)
+                if progress:
+                    progress()
+                if finished:
+                    finished(v_path)
+        except BaseException:
+            # chunks which did not start are not computed
+            for chunk in pending:
+                chunk[-1].cancel()
+            raise
+
+
+# runs function(v_path, settings) for every video
+# with more than one worker the videos are distributed to a pool of processes,
+# progress is called in the calling process after each finished video,
+# which is also recorded in manifest (CacheManifest) and passed to finished(v_path) if given,
+# so later steps of a video can run while the workers process the next videos
+# worker processes are always spawned (as on Windows), forking the GUI process with running threads can deadlock
+# a set cancel event (see check_cancel) stops the run between two frames and raises Cancelled,
+# videos which were not finished keep no outputs
+def run_videos(function, video_paths, settings, progress=None, manifest=None, finished=None, cancel=None):
+    workers = int(settings["workers"])
+    if workers > 1 and int(settings["chunk_frames"]) > 0 and function in CHUNKED_FUNCTIONS:
+        run_chunks(function, video_paths, settings, workers, progress, manifest, finished, cancel)
+        return
+    workers = min(workers, len(video_paths))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+            futures = {executor.submit(function, v_path, settings, None, cancel): v_path for v_path in video_paths}
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    print(futures[future])
+                    if manifest is not None:
+                        manifest.record(function, futures[future], settings)
+                    if progress:
+                        progress()
+                    if finished:
+                        finished(futures[future])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for v_path in video_paths:
+            check_cancel(cancel)
+            print(v_path)
+            function(v_path, settings, cancel=cancel)
+            if manifest is not None:
+                manifest.record(function, v_path, settings)
+            if progress:
+                progress()
+            if finished:
+                finished(v_path)
+
+
+# normalizes the bodylengths of one worm (*_raw_lengths.txt) to the average before the light pulse
+# (pulsestart_f frames) and writes them to *_data.txt, values outside (lower_bound, upper_bound) are removed
+# returns the path of *_data.txt, None if the worm has no length before the pulse
+def normalize_lengths(text_path, pulsestart_f, lower_bound, upper_bound):
+    print(text_path)
+    file = open(text_path, "r")
+    lines = file.readlines()
+    body_lengths = []
+    for body_length in lines:
+        length = body_length.rstrip("\n")
+        if length == "None":
+            body_lengths.append(None)
+        else:
+            body_lengths.append(float(length))
+
+    list_tillpulsestart = []
+    for worm in body_lengths[5:pulsestart_f - 1]:
+        # remove None values
+        if worm:
+            list_tillpulsestart.append(worm)
+
+    # check if worm before pulse is usable for normalization
+    if len(list_tillpulsestart) != 0:
+        # get average before pulse
+        average_before_pulse = sum(list_tillpulsestart) / len(list_tillpulsestart)
+
+        # normalization
+        bodylength_norm = []
+        for value in body_lengths:
+            if value:
+                value_norm = value / average_before_pulse
+                # remove values above upper boundary and below lower boundary
+                if lower_bound < value_norm < upper_bound:
+                    bodylength_norm.append(value_norm)
+                else:
+                    bodylength_norm.append(None)
+            else:
+                bodylength_norm.append(None)
+
+        # writes bodylengths to textfiles
+        textfile = open(text_path[:-16] + "_data.txt", "w")
+        for element in bodylength_norm:
+            textfile.write(str(element) + "\n")
+        textfile.close()
+        return text_path[:-16] + "_data.txt"
+    else:
+        print("Error found for " + text_path)
+        print("Please check if gamma value was adjusted correctly!\n")
+        return None
+
+
+# writes the normalized bodylengths of all worms of one condition (text_paths, *_data.txt)
+# to <condition>/<condition>_results.xlsx, animals with less than 50% measured bodylengths are listed separately
+def analyze_condition(video_root, folder, text_paths):
+    from pandas import DataFrame, concat, ExcelWriter
+    print("Analyze data for condition " + "\"" + folder + "\":")
+    file_names = [basename(text_path)[:-9] for text_path in text_paths]
+    body_lengths_list = []
+
+    body_lengths_list_deleted = []
+    file_names_deleted =[]
+
+    print(file_names)
+    for num, text_path in enumerate(text_paths):
+        print("\nFile: " + text_path)
+        file = open(text_path, "r")
+        lines = file.readlines()
+        body_lengths = []
+        for body_length in lines:
+            length = body_length.rstrip("\n")
+            if length == "None":
+                body_lengths.append(None)
+            else:
+                body_lengths.append(float(length))
+        value_numer = sum(x is not None for x in body_lengths)
+        total_number = len(body_lengths)
+        percentage_of_values = value_numer*100/total_number
+        print ("Fraction of measured bodylengths: " + str(percentage_of_values) + " %")
+        if percentage_of_values > 50:
+            body_lengths_list.append(body_lengths)
+        else:
+            body_lengths_list_deleted.append(body_lengths)
+            print ("This animal is excluded from analysis.")
+            popped = file_names.pop(num)
+            file_names_deleted.append(popped)
+    print("\nThese animals were removed: " + str(file_names_deleted))
+    if any(body_lengths_list):
+        df = DataFrame(body_lengths_list)
+        df = DataFrame.transpose(df)
+        mean = df.mean(axis=1, skipna=True)
+        sem = df.sem(axis=1, skipna=True)
+        n = df.count(axis=1)
+        df_final = concat([df, mean, sem, n], axis=1)
+        column_names = [str(x) for x in file_names]
+        column_names.append("Mean")
+        column_names.append("SEM")
+        column_names.append("n")
+        df_final.columns = [column_names]
+
+    if any(body_lengths_list_deleted):
+        df2 = DataFrame(body_lengths_list_deleted)
+        df2 = DataFrame.transpose(df2)
+        df2.columns = [str(x) for x in file_names_deleted]
+
+    with ExcelWriter(video_root + "/" + folder + "/" + folder + "_results.xlsx") as writer:
+        if any(body_lengths_list):
+            df_final.to_excel(writer, sheet_name=folder, engine='openpyxl')
+        if any(body_lengths_list_deleted):
+            df2.to_excel(writer, sheet_name="Omitted animals", engine='openpyxl')
+    print("Results written as: " + str(video_root) + str(folder) + "_results.xlsx")
+    print("\n")
+
+
+# live sources of grayscale frames (uint8, height x width) which are measured while they are recorded
+
+# frames of a video file which is still written, ffmpeg waits for new data at the end of the file
+# and stops if the file did not grow for timeout seconds
+def growing_frames(v_path, timeout=10, roi=None, scale=1):
+    follow = ['-follow', '1', '-seekable', '0', '-rw_timeout', str(int(timeout * 1000000)),
+              '-probesize', '65536', '-analyzeduration', '0']
+    return read_frames(v_path, gray=True, roi=roi, scale=scale, input_params=follow)
+
+
+# raw 8 bit grayscale frames of width x height pixels from a binary stream,
+# e.g. the standard input of "ffmpeg -i <camera> -f rawvideo -pix_fmt gray -"
+def pipe_frames(stream, width, height, roi=None, scale=1):
+    while True:
+        data = stream.read(width * height)
+        if len(data) < width * height:
+            break
+        yield downscale_frame(crop_frame(frombuffer(data, uint8).reshape(height, width), roi), scale)
+
+
+# frames of a dark worm on a bright background which is 15% shorter during the light pulse,
+# a stand-in for a camera to try the live measurement, frames are delivered at framerate
+def synthetic_frames(frames=300, pulse_frame=100, framerate=30, width=640, height=480, length=400, roi=None,
+                     scale=1):
+    rng = default_rng(0)
+    start = time()
+    for num in range(frames):
+        sleep(max(0, start + num / framerate - time()))
+        frame = rng.integers(180, 220, (height, width), dtype=uint8)
+        worm_length = length * (0.85 if num >= pulse_frame else 1.0)
+        for step in range(int(worm_length)):
+            x = int(width / 2 - worm_length / 2 + step)
+            y = int(height / 2 + 30 * sin(step / 40 + num / 10))
+            frame[y - 10:y + 10, x - 10:x + 10] = 50
+        yield downscale_frame(crop_frame(frame, roi), scale)
+
+
+def crop_frame(frame, roi):
+    if roi is None:
+        return frame
+    return crop_roi(frame, roi)
+
+
+# mean of scale x scale blocks of pixels (like the area scaling of read_frames)
+def downscale_frame(frame, scale):
+    if scale <= 1:
+        return frame
+    height, width = frame.shape[0] // scale * scale, frame.shape[1] // scale * scale
+    blocks = frame[:height, :width].reshape(height // scale, scale, width // scale, scale)
+    return blocks.mean(axis=(1, 3)).astype(uint8)
+
+
+# frames of a live source read by a thread, at most queue_frames frames wait to be measured
+# if measuring falls behind, the oldest waiting frames are dropped, so the latency stays bounded
+class FrameQueue(object):
+
+    def __init__(self, frames, queue_frames):
+        self.waiting = deque(maxlen=queue_frames)
+        self.condition = Condition()
+        self.finished = False
+        self.received = 0
+        self.thread = Thread(target=self.read, args=(frames,), daemon=True)
+        self.thread.start()
+
+    def read(self, frames):
+        try:
+            for frame in frames:
+                with self.condition:
+                    self.waiting.append((self.received, time(), frame))
+                    self.received += 1
+                    self.condition.notify()
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+
+    # next frame (number, arrival time, frame), None at the end of the source
+    def get(self):
+        with self.condition:
+            while not self.waiting and not self.finished:
+                self.condition.wait()
+            if not self.waiting:
+                return None
+            return self.waiting.popleft()
+
+
+# lengths of the frames of a live source in the order of the frames: (frame number, length, latency in s)
+# frames are segmented by Otsu thresholds (background models need the whole video),
+# dropped frames have length and latency None
+def live_lengths(frames, settings, queue_frames=8):
+    scale = int(settings["downscale"])
+    tracker = WormTracker(settings)
+    queue = FrameQueue(frames, queue_frames)
+    expected = 0
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        num, arrival, frame = item
+        for dropped in range(expected, num):
+            yield dropped, None, None
+        expected = num + 1
+        binary = binarize_frame(frame, settings["gamma"], scale, settings["cleanup"], settings["kernels"])
+        length = tracker.measure(binary)[0]
+        yield num, scale_length(length, scale), time() - arrival
+
+
+# steps of WormRuler for all videos of an experiment (video root with one subfolder per condition)
+# parameters are taken from settings (see DEFAULT_SETTINGS), progress(done, total) is called after every video
+# (every condition for data analysis), an ExperimentIndex can be shared by several steps so the tree is scanned once
+# videos whose outputs are up to date (CacheManifest) are skipped unless force is set
+# a set cancel event stops a step between two frames (two files for normalization and data analysis)
+# and raises Cancelled
+# the processed videos are returned
+
+# calls progress(done, total) for every call of the returned function
+def count_progress(progress, total):
+    done = [0]
+
+    def step():
+        done[0] += 1
+        if progress:
+            progress(done[0], total)
+    return step
+
+
+# runs function for the videos of video_paths which are not up to date,
+# finished(v_path) is called for every video whose outputs are complete (also if they were up to date)
+def run_step(function, index, video_paths, settings, progress=None, force=False, finished=None, cancel=None):
+    manifest = CacheManifest(index.root)
+    stale_paths = manifest.stale(function, video_paths, settings, force)
+    if finished:
+        for v_path in video_paths:
+            if v_path not in stale_paths:
+                finished(v_path)
+    run_videos(function, stale_paths, settings, count_progress(progress, len(stale_paths)), manifest, finished,
+               cancel)
+    index.add_outputs(function, stale_paths)
+    return stale_paths
+
+
+# ROI of the experiment from *_ROI.txt if settings has none
+def experiment_settings(settings, index):
+    if settings["roi"] is None:
+        settings = dict(settings, roi=read_roi_file(index.roi_path()))
+    return settings
+
+
+# background correction of all videos, writes *_bw.npz
+def correct_experiment(video_root, settings, progress=None, force=False, index=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    print("Following conditions found: " + str(index.conditions) + "\n")
+    if settings["crop_first"]:
+        settings = experiment_settings(settings, index)
+    return run_step(correct_video, index, index.videos(), settings, progress, force, cancel=cancel)
+
+
+# skeletonization of all background corrected videos, writes *_raw_lengths.txt
+def skeletonize_experiment(video_root, settings, progress=None, force=False, index=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    print("Following conditions found: " + str(index.conditions) + "\n")
+    return run_step(skeletonize_video, index, index.masks(), experiment_settings(settings, index), progress, force,
+                    cancel=cancel)
+
+
+# background correction and skeletonization of all videos in a single pass, writes *_raw_lengths.txt
+def process_experiment(video_root, settings, progress=None, force=False, index=None, finished=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    print("Following conditions found: " + str(index.conditions) + "\n")
+    return run_step(process_video, index, index.videos(), experiment_settings(settings, index), progress, force,
+                    finished, cancel)
+
+
+# frame of the light pulse (settings["pulse_start"] in seconds)
+def pulse_frame(settings):
+    if settings["pulse_start"] is None:
+        raise ValueError("Start of the light pulse (pulse_start) is needed for normalization.")
+    return int(settings["pulse_start"]) * int(settings["framerate"])
+
+
+# normalization of the lengths of all videos, writes *_data.txt
+def normalize_experiment(video_root, settings, progress=None, index=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    pulsestart_f = pulse_frame(settings)
+    step = count_progress(progress, len(index.raw_lengths()))
+    print("Following conditions found: " + str(index.conditions) + "\n")
+    for folder in index.conditions:
+        print("Normalize skeleton data for condition " + "\"" + folder + "\":")
+        for text_path in index.raw_lengths(folder):
+            check_cancel(cancel)
+            data_path = normalize_lengths(text_path, pulsestart_f, settings["lower_bound"], settings["upper_bound"])
+            if data_path is not None:
+                index.add(data_path)
+            step()
+
+
+# data analysis of all conditions, writes <condition>/<condition>_results.xlsx
+def analyze_experiment(video_root, progress=None, index=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    step = count_progress(progress, len(index.conditions))
+    print("Following conditions found: " + str(index.conditions) + "\n")
+    for folder in index.conditions:
+        check_cancel(cancel)
+        analyze_condition(index.root, folder, index.data(folder))
+        step()
+
+
+# background correction, skeletonization, normalization and data analysis of all videos
+# the steps are scheduled per video: a video is normalized as soon as its *_raw_lengths.txt is written
+# (while the workers process the next videos) and a condition is analyzed as soon as all of its videos are done
+# progress, normalize_progress and analyze_progress are called like progress of the single steps
+def run_experiment(video_root, settings, progress=None, normalize_progress=None, analyze_progress=None,
+                   force=False, index=None, cancel=None):
+    if index is None:
+        index = ExperimentIndex(video_root)
+    pulsestart_f = pulse_frame(settings)
+    remaining = OrderedDict((folder, set(index.videos(folder))) for folder in index.conditions)
+    normalize_step = count_progress(normalize_progress, len(index.videos()))
+    analyze_step = count_progress(analyze_progress, len(index.conditions))
+
+    def finished(v_path):
+        data_path = normalize_lengths(v_path[:-4] + "_raw_lengths.txt", pulsestart_f,
+                                      settings["lower_bound"], settings["upper_bound"])
+        if data_path is not None:
+            index.add(data_path)
+        normalize_step()
+        for folder, videos in remaining.items():
+            if v_path in videos:
+                videos.discard(v_path)
+                if not videos:
+                    analyze_condition(index.root, folder, index.data(folder))
+                    analyze_step()
+
+    return process_experiment(video_root, settings, progress, force, index, finished, cancel)
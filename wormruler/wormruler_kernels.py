@@ -0,0 +1,149 @@
+from numba import njit
+from numpy import zeros, empty, array, uint8, int32, int64
+
+
+"""
+-----
+WormRuler kernels
+
+Thinning and morphology of binary frames compiled by numba, used instead of skimage if the setting "kernels"
+is "numba" (see clean_binary and measure_skeleton in wormruler_core.py). The results are the same as those of
+skimage.morphology (thin, closing, remove_small_objects and remove_small_holes with their default connectivity),
+check_kernels in wormruler_core.py compares both on videos ("kernels" command of wormruler_cli.py).
+Objects and holes of exactly the size limit are kept as by skimage 0.18, skimage 0.26 removes them.
+Compiled kernels are cached next to this file, so only the first run has to compile them.
+-----
+"""
+
+
+# lookup tables of the two subiterations of the thinning by Guo and Hall (as skimage.morphology.thin)
+# index: neighbours of a pixel (bit 0: right, counterclockwise to bit 7: bottom right), True: pixel is deleted
+def thin_luts():
+    g123 = zeros(256, uint8)
+    g123p = zeros(256, uint8)
+    for n in range(256):
+        bits = [n >> i & 1 for i in range(8)]
+        g1 = sum(1 for i in (0, 2, 4, 6) if not bits[i] and (bits[i + 1] or bits[(i + 2) % 8])) == 1
+        n1 = sum(1 for k in (1, 3, 5, 7) if bits[k] or bits[k - 1])
+        n2 = sum(1 for k in (1, 3, 5, 7) if bits[k] or bits[(k + 1) % 8])
+        g12 = g1 and min(n1, n2) in (2, 3)
+        g123[n] = g12 and not ((bits[1] or bits[2] or not bits[7]) and bits[0])
+        g123p[n] = g12 and not ((bits[5] or bits[6] or not bits[3]) and bits[4])
+    return g123, g123p
+
+
+G123_LUT, G123P_LUT = thin_luts()
+
+
+# neighbours of pixel (r, c) of an image with a border of zeros as index of the thinning lookup tables
+@njit(cache=True)
+def neighbour_code(skel, r, c):
+    return (skel[r, c + 1] | skel[r - 1, c + 1] << 1 | skel[r - 1, c] << 2 | skel[r - 1, c - 1] << 3 |
+            skel[r, c - 1] << 4 | skel[r + 1, c - 1] << 5 | skel[r + 1, c] << 6 | skel[r + 1, c + 1] << 7)
+
+
+# deletes the pixels of one subiteration, all pixels are tested before any of them is deleted
+# returns the number of deleted pixels
+@njit(cache=True)
+def thin_subiteration(skel, lut, rows, cols):
+    count = 0
+    for r in range(1, skel.shape[0] - 1):
+        for c in range(1, skel.shape[1] - 1):
+            if skel[r, c] and lut[neighbour_code(skel, r, c)]:
+                rows[count] = r
+                cols[count] = c
+                count += 1
+    for i in range(count):
+        skel[rows[i], cols[i]] = 0
+    return count
+
+
+@njit(cache=True)
+def thin_image(image, lut1, lut2):
+    height, width = image.shape
+    skel = zeros((height + 2, width + 2), uint8)
+    for r in range(height):
+        for c in range(width):
+            skel[r + 1, c + 1] = image[r, c]
+    rows = empty(height * width, int64)
+    cols = empty(height * width, int64)
+    while thin_subiteration(skel, lut1, rows, cols) + thin_subiteration(skel, lut2, rows, cols) > 0:
+        pass
+    return skel[1:-1, 1:-1] != 0
+
+
+# thinning of a binary image like skimage.morphology.thin
+def thin(binary):
+    return thin_image(binary.view(uint8), G123_LUT, G123P_LUT)
+
+
+# dilation (grow) or erosion with the cross of the 4 neighbours, pixels outside the image are ignored
+@njit(cache=True)
+def cross_filter(image, grow):
+    height, width = image.shape
+    out = image.copy()
+    for r in range(height):
+        for c in range(width):
+            if image[r, c] == grow:
+                continue
+            if (r > 0 and image[r - 1, c] == grow) or (r < height - 1 and image[r + 1, c] == grow) or \
+                    (c > 0 and image[r, c - 1] == grow) or (c < width - 1 and image[r, c + 1] == grow):
+                out[r, c] = grow
+    return out
+
+
+# closing of a binary image like skimage.morphology.closing with its default footprint
+@njit(cache=True)
+def closing(binary):
+    return cross_filter(cross_filter(binary, True), False)
+
+
+# labels the 4-connected regions of pixels with the given value, returns labels (0: other pixels)
+# and the size of every label
+@njit(cache=True)
+def label_regions(binary, value):
+    height, width = binary.shape
+    labels = zeros((height, width), int32)
+    sizes = [0]
+    stack = empty(height * width, int64)
+    for start in range(height * width):
+        r, c = start // width, start % width
+        if binary[r, c] != value or labels[r, c]:
+            continue
+        label = len(sizes)
+        labels[r, c] = label
+        stack[0] = start
+        top = 1
+        size = 0
+        while top:
+            top -= 1
+            pixel = stack[top]
+            y, x = pixel // width, pixel % width
+            size += 1
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < height and 0 <= nx < width and binary[ny, nx] == value and not labels[ny, nx]:
+                    labels[ny, nx] = label
+                    stack[top] = ny * width + nx
+                    top += 1
+        sizes.append(size)
+    return labels, array(sizes)
+
+
+# sets regions of pixels with the given value which are smaller than min_size to the other value
+@njit(cache=True)
+def remove_small_regions(binary, value, min_size):
+    labels, sizes = label_regions(binary, value)
+    out = binary.copy()
+    for r in range(binary.shape[0]):
+        for c in range(binary.shape[1]):
+            if labels[r, c] and sizes[labels[r, c]] < min_size:
+                out[r, c] = not value
+    return out
+
+
+# remove small objects, close, fill small holes like clean_binary with skimage
+@njit(cache=True)
+def clean_binary(binary, min_size, area_threshold):
+    binary = remove_small_regions(binary, True, min_size)
+    binary = closing(binary)
+    return remove_small_regions(binary, False, area_threshold)
@@ -1,24 +1,23 @@
-from os import walk
-from os.path import join, basename, exists
+from os.path import basename, exists
+from multiprocessing import freeze_support, get_context
+from queue import Queue, Empty
+from threading import Thread
+from traceback import print_exc
 from cv2 import selectROI, imshow, destroyWindow
-from pandas import DataFrame, concat, ExcelWriter
 from imageio import get_reader, get_writer
 
-from skimage.morphology import thin, remove_small_holes, remove_small_objects, closing
-from skimage.util import img_as_ubyte, img_as_bool
-from skimage.filters import threshold_otsu
-from skimage.util import invert
-from skimage import color
+from skimage.util import img_as_ubyte
 
-from fil_finder import FilFinder2D
-from astropy.units import pix, pc
-
-from warnings import filterwarnings
-from tkinter import filedialog, messagebox, Button, Label, Entry, StringVar, Checkbutton, IntVar, Tk, Toplevel, Canvas, PhotoImage
+from tkinter import filedialog, messagebox, Button, Label, Entry, StringVar, Checkbutton, IntVar, Tk, Toplevel, Canvas, PhotoImage, \
+    OptionMenu
 from tkinter.font import Font
 from tkinter.ttk import Button as tButton
 from tkinter.ttk import Separator, Progressbar
 
+from wormruler_core import DEFAULT_SETTINGS, video_binaries, read_masks, mask_scale, ExperimentIndex, correct_experiment, \
+    skeletonize_experiment, normalize_experiment, analyze_experiment, run_experiment, pulse_frame, read_roi_file, \
+    Cancelled
+
 #from time import process_time
 
 
@@ -65,19 +64,60 @@ Version 1.0.1 (Seidenthal)
 Version 1.1.0 (Seidenthal)
 - Added Preview of background correction
 - Added exclusion of animals where more than 50% of Datapoints are invalid
+Version 1.2.0
+- "Start all" decodes every video only once: thresholding, ROI crop, skeletonization and length
+  measurement run in memory, *_bw.gif and *_skel.gif are only written if "Save GIFs" is checked
+- Processing functions moved to wormruler_core.py
+- Added "Workers" entry: background correction and skeletonization process several videos in parallel
+- With several workers, skeletonization splits videos into chunks of frames, so long videos use all workers
+- Added "Batch" entry: background correction can threshold blocks of frames together
+- Added "Median bg" option: background correction subtracts a median background image of each video
+  (cached as *_background.npz) instead of thresholding every frame on its own
+- ffmpeg decodes videos directly to grayscale and crops *_bw.gif frames to the ROI,
+  added "Downscale" entry to reduce the resolution of raw videos while decoding
+  (*_bw.npz records the factor, skeletonization and ROI selection use it instead of the current entry)
+- Added "Crop first" option: raw videos are cropped to the ROI before thresholding and cleanup
+- Background correction writes bit-packed *_bw.npz instead of *_bw.gif (about 1 bit per pixel, no decoding),
+  skeletonization still reads *_bw.gif of older versions
+- Added "Skeleton" selection: lengths can be measured by a faster skeleton graph analysis instead of FilFinder,
+  "parity" measures with both and writes the differences per frame to *_parity.txt
+- Skeleton lengths are taken from FilFinder as numbers instead of parsing their printed text,
+  *_raw_lengths.txt is written with a larger buffer
+- Added "Track worm" option: skeletonization only processes the bounding box of the worm in the previous frame
+- Frames identical to one of the last 64 different frames of a video reuse its length and skeleton
+- Output files are written under a temporary name and renamed when a video is complete
+- Added "Resumable" option: finished chunks of skeletonization are saved, interrupted videos continue from them,
+  added "Chunk" entry for the number of frames of a chunk
+- Outputs are recorded in <root>_cache.json with a key of their input file and the parameters they depend on,
+  only missing or outdated outputs are computed again, "Recompute all" replaces "Override existing skeletons"
+- The video folder is scanned once per step (once for "Start all"), conditions, videos and their output files
+  are looked up in this index instead of searching the folder again for every condition
+- "Start all" normalizes every video as soon as it is skeletonized and analyzes each condition as soon as
+  all of its videos are done, instead of waiting for all videos before the next step
+- Added wormruler_cli.py: "watch" processes new videos of a folder while they are recorded
+  (background correction, skeletonization, normalization) and updates the <condition>_results.xlsx,
+  normalization and data analysis moved to wormruler_core.py
+- Added "live" command: lengths of a video which is still recorded (or of raw frames from a pipe)
+  are printed while the video is recorded, frames are dropped if the measurement falls behind
+- All steps are functions of wormruler_core.py with explicit settings and a progress callback
+  (correct_experiment, skeletonize_experiment, normalize_experiment, analyze_experiment, run_experiment),
+  the GUI only collects the settings and shows the progress
+- wormruler_cli.py runs every step or all steps without GUI (correct, skeletonize, process, normalize, analyze, all)
+  with settings from a JSON file (--config) and the command line, libraries are loaded when a step needs them
+- Steps run in the background, the GUI stays responsive while videos are processed,
+  added "Cancel" button: the running step stops after the current frame, finished videos are kept
+- Decoding, processing and writing of a video run in separate threads connected by short queues,
+  so ffmpeg and the GIF encoder work while the next frames are processed
+- Added "Worm only" option: background correction labels the objects of a frame once and keeps the objects of
+  worm size (a worm split in two parts keeps both) with their small holes filled, closing and hole filling
+  only process the bounding box of these objects instead of the whole frame
+- Added "Numba" option: thinning and removal of small objects and holes are compiled by numba
+  (wormruler_kernels.py, same results as skimage), skimage is used if numba is not installed
+- Added "Skip unusable" option: skeletonization stops a video as soon as half of its frames have no length
+  (it would be excluded by data analysis anyway), the video is reported in *_unusable.txt
 -----
 """
 
-# GUI window
-gui = Tk()
-gui.geometry('340x570')
-gui.title("WormRuler")
-gui.iconbitmap('wormruler_ico.ico')
-
-# Ignore warnings
-filterwarnings('ignore', '.*No beam width given.*', )
-filterwarnings('ignore', '.*Graph pruning reached max iterations.*', )
-
 # WormRuler code
 
 # Function to crop video according to ROI which ist needed if round field of view is used
@@ -98,44 +138,25 @@ def background_check():
         Gamma_value = float(Gamma_value)
         video_root = video_path.get() + "/"
 
-        # find all subfolders which are labeled according to the measurement conditions
-        folders = []
-        for r, d, f in walk(video_root):
-            for folder in d:
-                folders.append(folder)
+        # subfolders are labeled according to the measurement conditions
+        index = ExperimentIndex(video_root)
 
-        for folder in folders:
+        for folder in index.conditions:
             print("Preview of background correction of condition " + "\"" + folder + "\":")
 
-            # find all videos in the respective folder
-            video_paths = []
-            for r, d, f in walk(str(video_root) + "/" + str(folder)):
-                for file in f:
-                    if ".AVI" in file or ".avi" in file or ".mov" in file or ".MOV" in file:
-                        video_paths.append(join(r, file))
-            v_path = video_paths[0]
+            # first video in the respective folder
+            v_path = index.videos(folder)[0]
             print(v_path)
-            vid = get_reader(v_path, 'ffmpeg')
+            settings = get_settings()
+            if not load_crop_roi(settings):
+                return
 
             with get_writer(video_root + "Background_preview.gif", mode='I', fps=int(framerate.get())) as writer:
                 # get frames
-                for num, image in enumerate(vid):
-                    # convert to grayscale
-                    img = color.rgb2gray(image)
-
-                    # get threshold and make binary
-                    otsu = threshold_otsu(img)
-                    binary = img > otsu * Gamma_value
-                    binary = invert(binary)
-                    # close holes, remove small objects
-                    binary = remove_small_objects(binary, min_size=2000)
-                    binary = closing(binary)
-                    binary = remove_small_holes(binary, area_threshold=700)
+                for binary in video_binaries(v_path, settings, stop=10):
                     # write image to file
                     binary = img_as_ubyte(binary)
                     writer.append_data(binary)
-                    if num == 9:
-                        break
             break
         toplvl = Toplevel()  # created Toplevel widger
         photo = PhotoImage(file=video_root + "Background_preview.gif")
@@ -147,7 +168,7 @@ def background_check():
         print("\nPreview done.")
 
 # substracts background and writes binary gif file
-def background_correction():
+def background_correction(index=None):
     bw_done.grid_remove()
     print("Background correction started... \n")
 
@@ -155,220 +176,96 @@ def background_correction():
     if Gamma_value == "":
         messagebox.showerror("Error", "Please enter Gamma value.\nShould be approximately between 0.7 and 1.3.")
     else:
-        # open vid
-        Gamma_value = float(Gamma_value)
         video_root = video_path.get() + "/"
+        settings = get_settings()
+        if not load_crop_roi(settings):
+            return
+        force = check.get() == 1
+
+        # videos whose *_bw.npz is up to date are skipped
+        progressbar_bw['value'] = 0
 
-        # find all subfolders which are labeled according to the measurement conditions
-        folders = []
-        for r, d, f in walk(video_root):
-            for folder in d:
-                folders.append(folder)
-        print("Following conditions found: " + str(folders) + "\n")
-
-        progress_bw_value = 0
-        progress_bw_list = []
-        for r, d, f in walk(str(video_root)):
-            for file in f:
-                if ".AVI" in file or ".avi" in file or ".mov" in file or ".MOV" in file:
-                    progress_bw_list.append(file)
-        progress_bw_steps = 100 / len(progress_bw_list)
-
-        for folder in folders:
-            print("Background correction of condition " + "\"" + folder + "\":")
-
-            # find all videos in the respective folder
-            video_paths = []
-            for r, d, f in walk(str(video_root) + "/" + str(folder)):
-                for file in f:
-                    if ".AVI" in file or ".avi" in file or ".mov" in file or ".MOV" in file:
-                        video_paths.append(join(r, file))
-            for v_path in video_paths:
-                print(v_path)
-                vid = get_reader(v_path, 'ffmpeg')
-
-                with get_writer(v_path[:-4] + "_bw.gif", mode='I', fps=int(framerate.get())) as writer:
-                    # get frames
-                    for num, image in enumerate(vid):
-                        # convert to grayscale
-                        img = color.rgb2gray(image)
-
-                        # get threshold and make binary
-                        otsu = threshold_otsu(img)
-                        binary = img > otsu * Gamma_value
-                        binary = invert(binary)
-                        # close holes, remove small objects
-                        binary = remove_small_objects(binary, min_size=2000)
-                        binary = closing(binary)
-                        binary = remove_small_holes(binary, area_threshold=700)
-                        # write image to file
-                        binary = img_as_ubyte(binary)
-                        writer.append_data(binary)
-
-                    progress_bw_value += progress_bw_steps
-                    progressbar_bw['value'] = progress_bw_value
-                    progressbar_bw.update()
+        def step(cancel):
+            video_paths = correct_experiment(video_root, settings, bar_progress(progressbar_bw), force, index, cancel)
+            if len(video_paths) == 0:
+                print("\nAll files background corrected! Check \"Recompute all\" or proceed to skeletonization!\n")
 
             print("\n")
-        bw_done.grid(row=6, column=1, sticky='w', padx=200)
-        print("Background correction complete!")
-        print("Ready for skeletonization.")
+            gui_call(bw_done.grid, row=6, column=1, sticky='w', padx=200)
+            print("Background correction complete!")
+            print("Ready for skeletonization.")
+        start_step(step)
 
 
 # create ROI to remove edges, write ROI coordinates to text file, make new for each day of measurement
 # simply draw ROI over whole image if the field of view is rectengular
 
-def ROI_set():
+def ROI_set(index=None):
     print("\nSelect ROI for skeletonization!\n")
     # open vid
     video_root = video_path.get() + "/"
     root_name = basename(video_path.get())
-    folders = []
-    for r, d, f in walk(video_root):
-        for folder in d:
-            folders.append(folder)
-
-    video_paths = []
-    for r, d, f in walk(str(video_root) + "/" + str(folders[0])):
-        for file in f:
-            if "_bw.gif" in file:
-                video_paths.append(join(r, file))
+    if index is None:
+        index = ExperimentIndex(video_root)
+
+    # with "Crop first", ROI is selected on the raw videos before background correction
+    if crop_check.get() == 1:
+        video_paths = index.videos(index.conditions[0])
+    else:
+        video_paths = index.masks(index.conditions[0])
+    # ROI is stored in pixels of the raw videos, masks of downscaled videos are downscaled as well
+    scale = mask_scale(video_paths[0])
     # read first video and set ROI
-    vid1 = get_reader(video_paths[0], 'ffmpeg')
+    if video_paths[0].endswith(".npz"):
+        vid1 = (img_as_ubyte(binary) for binary in read_masks(video_paths[0]))
+    else:
+        vid1 = get_reader(video_paths[0], 'ffmpeg')
     for frame in vid1:
         fromCenter = False
         roi = selectROI(frame, fromCenter)
         imCrop = frame[int(roi[1]):int(roi[1] + roi[3]), int(roi[0]):int(roi[0] + roi[2])]
         imshow("ROI", imCrop)
         textfile = open(video_root + str(root_name) + "_ROI.txt", "w")
-        textfile.write('\n'.join(str(s) for s in roi))
+        textfile.write('\n'.join(str(int(s) * scale) for s in roi))
 
         textfile.close()
+        index.add(video_root + str(root_name) + "_ROI.txt")
         destroyWindow('ROI selector')
         destroyWindow('ROI')
         break
 
 
-# takes background corrected gifs and crops them using the predefined ROI
+# takes background corrected frames (*_bw.npz, *_bw.gif of older versions) and crops them using the predefined ROI
 # makes skeleton of worms and writes them to new gif
 # analyzes length of skeleton and stores values in textfile for each worm
-def skeletonize():
+def skeletonize(index=None):
 
     print("ROI selected. Starting skeletonization...")
     # open vid
     video_root = video_path.get() + "/"
-    progress_skel_value = 0
-    progress_skel_list = []
-    if check.get() == 1:
-        for r, d, f in walk(str(video_root)):
-            for file in f:
-                if "_bw.gif" in file:
-                    progress_skel_list.append(file)
-        progress_skel_steps = 100 / len(progress_skel_list)
-    else:
-        for r, d, f in walk(str(video_root)):
-            for file in f:
-                if "_bw.gif" in file:
-                    if exists(join(r, file[:-7]) + "_raw_lengths.txt"):
-                        pass
-                    else:
-                        progress_skel_list.append(file)
-        if len(progress_skel_list) == 0:
-            print("\nAll files skeletonized! Check override or proceed to normalization!\n")
-        else:
-            progress_skel_steps = 100 / len(progress_skel_list)
-
-    folders = []
-    for r, d, f in walk(video_root):
-        for folder in d:
-            folders.append(folder)
-
-    print("Following conditions found: " + str(folders) + "\n")
-
-    # get roi from txtfile
-    roi_file = []
-    for r, d, f in walk(video_root):
-        for file in f:
-            if file.endswith("_ROI.txt"):
-                roi_file.append(join(r, file))
-    textfile = open(roi_file[0], "r")
-    lines = textfile.readlines()
-    roi = []
-    for line in lines:
-        line.strip(r"\n")
-        roi.append(int(line))
-    textfile.close()
-
-    for folder in folders:
-        print("Skeletonizing condition " + "\"" + folder + "\":")
-
-        video_paths = []
-        if check.get() == 1:
-            for r, d, f in walk(str(video_root) + "/" + str(folder)):
-                for file in f:
-                    if "_bw.gif" in file:
-                        video_paths.append(join(r, file))
-        else:
-            for r, d, f in walk(str(video_root) + "/" + str(folder)):
-                for file in f:
-                    if "_bw.gif" in file:
-                        if exists(join(r, file[:-7]) + "_raw_lengths.txt"):
-                            pass
-                        else:
-                            video_paths.append(join(r, file))
-
-        for v_path in video_paths:
-            print(v_path)
-            vid = get_reader(v_path, 'ffmpeg')
-            # get frames
-            skel_txt = open(v_path[:-7] + "_raw_lengths.txt", "w")
-
-            with get_writer(v_path[:-7] + "_skel.gif", mode='I', fps=int(framerate.get())) as writer:
-                for num, frame in enumerate(vid):
-                    img = color.rgb2gray(frame)
-                    # crop image
-                    a, b, c, d = roi
-                    img_crop = img[int(b):int(b + d), int(a):int(a + c)]
-                    binary = img_as_bool(img_crop)
-                    skel = thin(binary)
-                    try:
-                        fil = FilFinder2D(skel, distance=250 * pc, mask=skel)
-                        fil.medskel(verbose=False)
-                        fil.analyze_skeletons(branch_thresh=5 * pix, skel_thresh=10 * pix, prune_criteria='length')
-                        skel_fil = fil.skeleton_longpath
-                        skel_length = fil.lengths()
-                        skel_str = str(skel_length)
-                        skel_num = skel_str[1:-5]
-                        skel_list = skel_num.split("  ")
-                        skel_list2 = ' '.join(skel_list).split()
-                        skel_floats = [float(x) for x in skel_list2]
-                        skel_floats.sort(reverse=True)
-                        if len(skel_floats) == 1:
-                            skel_txt.write(str(skel_floats[0]) + "\n")
-                        elif len(skel_floats) == 2:
-                            combined = skel_floats[0] + skel_floats[1]
-                            skel_txt.write(str(combined) + "\n")
-                        else:
-                            skel_txt.write("None" + "\n")
-                        skel_fil_gif = img_as_ubyte(skel_fil)
-                        writer.append_data(skel_fil_gif)
-                    except:
-                        skel_txt.write("None" + "\n")
-            skel_txt.close()
-            progress_skel_value += progress_skel_steps
-            progressbar_skel['value'] = progress_skel_value
-            progressbar_skel.update()
+    settings = get_settings()
+    force = check.get() == 1
 
-        print("\n")
-    skel_done.grid(row=10, column=1, sticky='w', padx=200)
-    print("Skeletonization complete.")
-    print("Ready for normalization.\n")
+    # *_bw.gif is only used if there is no *_bw.npz of the same video,
+    # videos whose *_raw_lengths.txt is up to date are skipped
+    progressbar_skel['value'] = 0
+
+    def step(cancel):
+        video_paths = skeletonize_experiment(video_root, settings, bar_progress(progressbar_skel), force, index,
+                                             cancel)
+        if len(video_paths) == 0:
+            print("\nAll files skeletonized! Check \"Recompute all\" or proceed to normalization!\n")
 
+        print("\n")
+        gui_call(skel_done.grid, row=10, column=1, sticky='w', padx=200)
+        print("Skeletonization complete.")
+        print("Ready for normalization.\n")
+    start_step(step)
 
 
 # normalizes bodylengths to predefined pulsestart
 # writes normalized bodylengths to textfile for each worm
-def normalize():
+def normalize(index=None):
     print("Starting normalization...\n")
     # open vid
     video_root = video_path.get() + "/"
@@ -376,86 +273,94 @@ def normalize():
     if pulsestart_f == "":
         messagebox.showerror("Error", "Please enter start of light pulse (in seconds)")
     else:
-        pulsestart_s = int(pulse_start.get())
-        print("Pulse started after " + str(pulsestart_s) + "s")
-        pulsestart_f = pulsestart_s * int(framerate.get())
-        print("(or after " + str(pulsestart_f) + " frames!)\n")
+        settings = get_settings()
+        print_pulse_start(settings)
 
         normalize_done.grid_remove()
-        progress_norm_value = 0
-        progress_norm_list = []
-        for r, d, f in walk(str(video_root)):
-            for file in f:
-                if "_bw.gif" in file:
-                    progress_norm_list.append(file)
-        progress_norm_steps = 100 / len(progress_norm_list)
-
-        folders = []
-        for r, d, f in walk(video_root):
-            for folder in d:
-                folders.append(folder)
-
-        print("Following conditions found: " + str(folders) + "\n")
-
-        for folder in folders:
-            print("Normalize skeleton data for condition " + "\"" + folder + "\":")
-
-            text_paths = []
-            for r, d, f in walk(str(video_root) + "/" + str(folder)):
-                for file in f:
-                    if "_raw_lengths.txt" in file:
-                        text_paths.append(join(r, file))
-
-            for text_path in text_paths:
-                print(text_path)
-                file = open(text_path, "r")
-                lines = file.readlines()
-                body_lengths = []
-                for body_length in lines:
-                    length = body_length.rstrip("\n")
-                    if length == "None":
-                        body_lengths.append(None)
-                    else:
-                        body_lengths.append(float(length))
-
-                list_tillpulsestart = []
-                for worm in body_lengths[5:pulsestart_f - 1]:
-                    # remove None values
-                    if worm:
-                        list_tillpulsestart.append(worm)
-
-                # check if worm before pulse is usable for normalization
-                if len(list_tillpulsestart) != 0:
-                    # get average before pulse
-                    average_before_pulse = sum(list_tillpulsestart) / len(list_tillpulsestart)
-
-                    # normalization
-                    bodylength_norm = []
-                    for value in body_lengths:
-                        if value:
-                            value_norm = value / average_before_pulse
-                            # remove values above upper boundary and below lower boundary
-                            if float(lower_bound.get()) < value_norm < float(upper_bound.get()):
-                                bodylength_norm.append(value_norm)
-                            else:
-                                bodylength_norm.append(None)
-                        else:
-                            bodylength_norm.append(None)
-
-                    # writes bodylengths to textfiles
-                    textfile = open(text_path[:-16] + "_data.txt", "w")
-                    for element in bodylength_norm:
-                        textfile.write(str(element) + "\n")
-                    textfile.close()
-                else:
-                    print("Error found for " + text_path)
-                    print("Please check if gamma value was adjusted correctly!\n")
-
-                progress_norm_value += progress_norm_steps
-                progressbar_normalize['value'] = progress_norm_value
-                progressbar_normalize.update()
-            normalize_done.grid(row=14, column=1, sticky='w', padx=200)
+        progressbar_normalize['value'] = 0
+
+        def step(cancel):
+            normalize_experiment(video_root, settings, bar_progress(progressbar_normalize), index, cancel)
+            gui_call(normalize_done.grid, row=14, column=1, sticky='w', padx=200)
             print("Ready for data analyis.")
+        start_step(step)
+
+
+def print_pulse_start(settings):
+    print("Pulse started after " + str(settings["pulse_start"]) + "s")
+    print("(or after " + str(pulse_frame(settings)) + " frames!)\n")
+
+
+# progress(done, total) of the processing steps shown by progress bars
+# called in the thread of the step, the bars are set by the GUI
+def bar_progress(*bars):
+    def progress(done, total):
+        gui_call(set_bars, bars, 100 * done / total)
+    return progress
+
+
+def set_bars(bars, value):
+    for bar in bars:
+        bar['value'] = value
+
+
+# processing steps run in a background thread, so the GUI does not freeze while videos are processed
+# Tk may only be used by the GUI thread: the step sends calls to events (gui_call), poll_events runs them
+# step(cancel) is called with the event which is set by the "Cancel" button
+def start_step(step):
+    global step_thread, cancel_manager, cancel_event
+    if step_thread is not None and step_thread.is_alive():
+        messagebox.showinfo("Running", "Please wait until the running step is finished or cancel it.")
+        return
+    # the event is shared with the worker processes, which stop after their current frame
+    if cancel_event is None:
+        cancel_manager = get_context("spawn").Manager()
+        cancel_event = cancel_manager.Event()
+    cancel_event.clear()
+    for button in step_buttons:
+        button['state'] = 'disabled'
+    btn_cancel['state'] = 'normal'
+    step_thread = Thread(target=run_in_background, args=(step, cancel_event), daemon=True)
+    step_thread.start()
+
+
+def run_in_background(step, cancel):
+    try:
+        step(cancel)
+    except Cancelled:
+        print("\nCancelled. Finished videos are kept, the others are processed again by the next start.\n")
+    except Exception as error:
+        print_exc()
+        gui_call(messagebox.showerror, "Error", repr(error))
+    finally:
+        gui_call(step_finished)
+
+
+def step_finished():
+    for button in step_buttons:
+        button['state'] = 'normal'
+    btn_cancel['state'] = 'disabled'
+
+
+def cancel_step():
+    if step_thread is not None and step_thread.is_alive():
+        print("\nCancelling after the current frame...")
+        cancel_event.set()
+
+
+# calls function(*args, **kwargs) in the GUI thread
+def gui_call(function, *args, **kwargs):
+    events.put((function, args, kwargs))
+
+
+def poll_events():
+    while True:
+        try:
+            function, args, kwargs = events.get_nowait()
+        except Empty:
+            break
+        function(*args, **kwargs)
+    gui.after(100, poll_events)
 
 
 # Combining functions roi_set, skeletonize and normalization
@@ -463,108 +368,34 @@ def skeletonization():
     skel_done.grid_remove()
     video_root = video_path.get() + "/"
     root_name = basename(video_path.get())
+    index = ExperimentIndex(video_root)
     if exists(video_root + str(root_name) + "_ROI.txt"):
-        skeletonize()
+        skeletonize(index)
     else:
-        ROI_set()
-        skeletonize()
+        ROI_set(index)
+        skeletonize(index)
 
 # takes textfiles containing normalized bodylengths and writes them to excelfile
 # calculates mean, sem and N
-def data_analyis():
+def data_analyis(index=None):
     data_done.grid_remove()
     print("\nData Analysis started...")
     video_root = video_path.get() + "/"
 
-    progress_data_value = 0
-    progress_data_list = []
-
-    folders = []
-    for r, d, f in walk(video_root):
-        for folder in d:
-            folders.append(folder)
-            progress_data_list.append(folder)
-    progress_data_steps = 100 / len(progress_data_list)
-    print("Following conditions found: " + str(folders) + "\n")
-
-    for folder in folders:
-        print("Analyze data for condition " + "\"" + folder + "\":")
-        # get textfiles with normalized bodylengths
-        text_paths = []
-        file_names = []
-        for r, d, f in walk(str(video_root) + "/" + str(folder)):
-            for file in f:
-                if "_data.txt" in file:
-                    text_paths.append(join(r, file))
-                    file_names.append(file[:-9])
-        body_lengths_list = []
-
-        body_lengths_list_deleted = []
-        file_names_deleted =[]
-
-        print(file_names)
-        for num, text_path in enumerate(text_paths):
-            print("\nFile: " + text_path)
-            file = open(text_path, "r")
-            lines = file.readlines()
-            body_lengths = []
-            for body_length in lines:
-                length = body_length.rstrip("\n")
-                if length == "None":
-                    body_lengths.append(None)
-                else:
-                    body_lengths.append(float(length))
-            value_numer = sum(x is not None for x in body_lengths)
-            total_number = len(body_lengths)
-            percentage_of_values = value_numer*100/total_number
-            print ("Fraction of measured bodylengths: " + str(percentage_of_values) + " %")
-            if percentage_of_values > 50:
-                body_lengths_list.append(body_lengths)
-            else:
-                body_lengths_list_deleted.append(body_lengths)
-                print ("This animal is excluded from analysis.")
-                popped = file_names.pop(num)
-                file_names_deleted.append(popped)
-        print("\nThese animals were removed: " + str(file_names_deleted))
-        if any(body_lengths_list):
-            df = DataFrame(body_lengths_list)
-            df = DataFrame.transpose(df)
-            mean = df.mean(axis=1, skipna=True)
-            sem = df.sem(axis=1, skipna=True)
-            n = df.count(axis=1)
-            df_final = concat([df, mean, sem, n], axis=1)
-            column_names = [str(x) for x in file_names]
-            column_names.append("Mean")
-            column_names.append("SEM")
-            column_names.append("n")
-            df_final.columns = [column_names]
-
-        if any(body_lengths_list_deleted):
-            df2 = DataFrame(body_lengths_list_deleted)
-            df2 = DataFrame.transpose(df2)
-            df2.columns = [str(x) for x in file_names_deleted]
-
-        with ExcelWriter(video_root + "/" + folder + "/" + folder + "_results.xlsx") as writer:
-            if any(body_lengths_list):
-                df_final.to_excel(writer, sheet_name=folder, engine='openpyxl')
-            if any(body_lengths_list_deleted):
-                df2.to_excel(writer, sheet_name="Omitted animals", engine='openpyxl')
-        print("Results written as: " + str(video_root) + str(folder) + "_results.xlsx")
-        print("\n")
+    progressbar_data['value'] = 0
 
-        progress_data_value += progress_data_steps
-        progressbar_data['value'] = progress_data_value
-        progressbar_data.update()
+    def step(cancel):
+        analyze_experiment(video_root, bar_progress(progressbar_data), index, cancel)
 
-    data_done.grid(row=17, column=1, sticky='w', padx=200)
-    print("Data analysis complete.")
-    print("Go and turn your data into beautiful graphs!")
+        gui_call(data_done.grid, row=17, column=1, sticky='w', padx=200)
+        print("Data analysis complete.")
+        print("Go and turn your data into beautiful graphs!")
+    start_step(step)
 
 
 def run_all():
     print("WormRuler - \"Run all\" function started:")
     # open vid
-    folders = []
     video_root = video_path.get() + "/"
     root_name = basename(video_path.get())
     pulsestart_f = pulse_start.get()
@@ -575,22 +406,13 @@ def run_all():
         if pulsestart_f == "":
             messagebox.showerror("Error", "Please enter start of light pulse (in seconds).")
         else:
+            # the tree is scanned once, the stages add the files they write to the index
+            index = ExperimentIndex(video_root)
             if exists(video_root + str(root_name) + "_ROI.txt"):
-                background_correction()
-                skeletonize()
-                normalize()
-                data_analyis()
+                pipeline(index)
             else:
                 print("\nSelect ROI for skeletonization first!\n")
-                for r, d, f in walk(video_root):
-                    for folder in d:
-                        folders.append(folder)
-
-                video_paths = []
-                for r, d, f in walk(str(video_root) + "/" + str(folders[0])):
-                    for file in f:
-                        if ".AVI" in file or ".avi" in file or ".mov" in file or ".MOV" in file:
-                            video_paths.append(join(r, file))
+                video_paths = index.videos(index.conditions[0])
                 # read first video and set ROI
                 vid1 = get_reader(video_paths[0], 'ffmpeg')
                 for frame in vid1:
@@ -602,16 +424,86 @@ def run_all():
                     textfile.write('\n'.join(str(s) for s in roi))
 
                     textfile.close()
+                    index.add(video_root + str(root_name) + "_ROI.txt")
                     destroyWindow('ROI selector')
                     destroyWindow('ROI')
                     break
-                background_correction()
-                skeletonize()
-                normalize()
-                data_analyis()
+                pipeline(index)
+
+
+# background correction and skeletonization, normalization and data analysis of "Start all"
+# the steps are scheduled per video (see run_experiment), every frame is decoded once:
+# threshold -> morphology -> ROI crop -> skeleton -> length,
+# *_bw.gif and *_skel.gif are only written if "Save GIFs" is checked
+def pipeline(index):
+    for done in (bw_done, skel_done, normalize_done, data_done):
+        done.grid_remove()
+    print("Background correction and skeletonization started... \n")
+    settings = get_settings()
+    print_pulse_start(settings)
+    for bar in (progressbar_bw, progressbar_skel, progressbar_normalize, progressbar_data):
+        bar['value'] = 0
+    force = check.get() == 1
+
+    def step(cancel):
+        video_paths = run_experiment(index.root, settings, bar_progress(progressbar_bw, progressbar_skel),
+                                     bar_progress(progressbar_normalize), bar_progress(progressbar_data),
+                                     force, index, cancel)
+        if len(video_paths) == 0:
+            print("\nAll files skeletonized! Check \"Recompute all\" to process them again!\n")
+
+        print("\n")
+        for done, row in ((bw_done, 6), (skel_done, 10), (normalize_done, 14), (data_done, 17)):
+            gui_call(done.grid, row=row, column=1, sticky='w', padx=200)
+        print("Data analysis complete.")
+        print("Go and turn your data into beautiful graphs!")
+    start_step(step)
+
+
+# collects the settings entered in the GUI for the processing functions
+def get_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    if gamma.get() != "":
+        settings["gamma"] = float(gamma.get())
+    settings["framerate"] = int(framerate.get())
+    settings["save_gifs"] = gif_check.get() == 1
+    settings["workers"] = max(1, int(workers.get()))
+    settings["batch_frames"] = max(0, int(batch_frames.get()))
+    settings["chunk_frames"] = max(0, int(chunk_frames.get()))
+    settings["downscale"] = max(1, int(downscale.get()))
+    settings["segmentation"] = "background" if median_check.get() == 1 else "otsu"
+    settings["cleanup"] = "largest" if worm_check.get() == 1 else "morphology"
+    settings["kernels"] = "numba" if numba_check.get() == 1 else "skimage"
+    settings["abort_unusable"] = unusable_check.get() == 1
+    settings["crop_first"] = crop_check.get() == 1
+    settings["skeleton_engine"] = engine.get()
+    settings["tracking"] = track_check.get() == 1
+    settings["checkpoint"] = resume_check.get() == 1
+    if pulse_start.get() != "":
+        settings["pulse_start"] = int(pulse_start.get())
+    settings["lower_bound"] = float(lower_bound.get())
+    settings["upper_bound"] = float(upper_bound.get())
+    return settings
+
+
+# loads the ROI needed by background correction with "Crop first"
+# returns False if no ROI was selected yet
+def load_crop_roi(settings):
+    if settings["crop_first"]:
+        video_root = video_path.get() + "/"
+        if not exists(video_root + basename(video_path.get()) + "_ROI.txt"):
+            messagebox.showerror("Error", "Please select ROI first.\n"
+                                          "\"Crop first\" needs the ROI for background correction.")
+            return False
+        settings["roi"] = read_roi_file(video_root + basename(video_path.get()) + "_ROI.txt")
+    return True
 
 
+# a running step is cancelled and its unfinished output files are removed before the window is closed
 def close():
+    if step_thread is not None and step_thread.is_alive():
+        cancel_event.set()
+        step_thread.join()
     gui.destroy()
 
 
@@ -667,203 +559,438 @@ def CreateToolTip(widget, text):
 
 
 # GUI setup
+# GUI is only built if WormRuler is started directly (not in worker processes)
+if __name__ == "__main__":
+    freeze_support()
+
+    # GUI window
+    gui = Tk()
+    gui.geometry('340x1045')
+    gui.title("WormRuler")
+    gui.iconbitmap('wormruler_ico.ico')
+
+    # GUI font styles
+    myFont = Font(family='Cambria', size=10, weight="bold")
+    titleFont = Font(family='Cambria', size=20, weight="bold")
+    fileFont = Font(size=9, weight="bold")
+
+    # Title
+    gui_title = Label(gui, text="WormRuler", font=titleFont)
+    gui_title.grid(row=1, column=1, pady=15, sticky='w', padx=70)
+
+    border_label = Label(gui, text="   ")
+    border_label.grid(row=2, column=0, sticky="w")
+
+    # Path selection
+    video_path = StringVar()
+    path_label = Label(gui, text="Path")
+    path_label.grid(row=2, column=1, sticky="w")
+    path_entry = Entry(gui, textvariable=video_path, width=28)
+    path_entry.grid(row=2, column=1, sticky='w', padx=30)
+    btn_path_entry = tButton(gui, text="Browse", command=getvideo_path)
+    btn_path_entry.grid(row=2, column=1, sticky='w', padx=210)
+
+    # Path selection info button
+    path_info = "Browse to folder with original videos.\n\n" \
+                "Optional:\n \"To merge experiments from different\n" \
+                " days, create a new folder with sub-\n" \
+                " folders for each condition to be merged.\n" \
+                " Copy all *_bw_data.txt from each condition\n" \
+                " into this new folder.\n" \
+                " Select this folder path and run \"Analyze Data\" again!\""
+
+    path_infobutton = Button(gui, text='i', font=myFont,
+                                bg='white', fg='blue', bd=0)
+    CreateToolTip(path_infobutton, text=path_info)
+    path_infobutton.grid(row=2, column=1, padx=290)
+
+    # GUI Separator background correction
+    Separator(gui, orient="horizontal").grid(row=3, column=0, columnspan=2, sticky='ew', pady=5)
+
+    # background correction GUI
+
+    gamma = StringVar()
+
+    gamma_label = Label(gui, text="Gamma:          ")
+    gamma_label.grid(row=5, column=1, sticky="w")
+    gamma_entry = Entry(gui, textvariable=gamma, width=3)
+    gamma_entry.grid(row=5, column=1, pady=5, padx=68, sticky='w')
+
+    btn_preview_start = tButton(gui, text="Preview", command=background_check)
+    btn_preview_start.grid(row=5, column=1, padx=210, sticky='w')
+
+    # Gamma info button
+    gamma_info = "Enter Gamma value depending on the brightness of the videos.\n" \
+                 "Should be approximately between 0.7 and 1.3.\n" \
+                 "Preview button creates a short video to check whether Gamma value is appropriate."
+
+    gamma_infobutton = Button(gui, text='i', font=myFont,
+                                 bg='white', fg='blue', bd=0)
+    CreateToolTip(gamma_infobutton, text=gamma_info)
+    gamma_infobutton.grid(row=5, column=1, padx=290)
+
+    bg_title = Label(gui, text="Background Correction", font=myFont)
+    bg_title.grid(row=4, column=1, pady=10, sticky='w')
+
+    # median background checkbox
+    median_check = IntVar()
+    median_checkbutton = Checkbutton(gui, text="(Median bg)", variable=median_check)
+    median_checkbutton.grid(row=4, column=1, padx=190, sticky="w")
+
+    median_info = "Subtract the median of frames spread over each video instead of thresholding every frame.\n" \
+                  "More robust to uneven illumination. The worm has to move during the video,\n" \
+                  "otherwise it becomes part of the background. Background is cached as *_background.npz."
+
+    median_infobutton = Button(gui, text='i', font=myFont,
+                                 bg='white', fg='blue', bd=0)
+    CreateToolTip(median_infobutton, text=median_info)
+    median_infobutton.grid(row=4, column=1, padx=290)
+
+    btn_bg_start = tButton(gui, text="Start", command=background_correction)
+    btn_bg_start.grid(row=6, column=1, sticky='w')
+
+    progressbar_bw = Progressbar(gui, length=100)
+    progressbar_bw.grid(row=6, column=1, sticky='w', padx=90)
+
+    bw_done = Label(gui, text="Done!", font=fileFont)
 
+    # GUI Separator skeletonize
+    Separator(gui, orient="horizontal").grid(row=7, column=0, columnspan=2, sticky='ew', pady=5)
 
-# GUI font styles
-myFont = Font(family='Cambria', size=10, weight="bold")
-titleFont = Font(family='Cambria', size=20, weight="bold")
-fileFont = Font(size=9, weight="bold")
-
-# Title
-gui_title = Label(gui, text="WormRuler", font=titleFont)
-gui_title.grid(row=1, column=1, pady=15, sticky='w', padx=70)
+    # skeletonize GUI
+    skel_title = Label(gui, text="Skeletonize", font=myFont)
+    skel_title.grid(row=9, column=1, pady=5, sticky='w')
 
-border_label = Label(gui, text="   ")
-border_label.grid(row=2, column=0, sticky="w")
+    # Check info button
+    check_info = "Keep unchecked if starting WormRuler for the first time.\n\n" \
+                "Unchecked:\n Background correction and skeletonization skip videos" \
+                " whose outputs are up to date.\n" \
+                " \"<root>_cache.json\" records the input and the settings (Gamma, ROI, ...)\n" \
+                " of every output, videos are processed again if one of them changed.\n" \
+                " Can be useful if program was stopped in between.\n" \
+                " \"*_raw_lengths.txt\" is only written when a video is complete,\n" \
+                " with \"Resumable\" interrupted videos continue where they stopped.\n" \
+                "Checked:\n All videos are processed again."
 
-# Path selection
-video_path = StringVar()
-path_label = Label(gui, text="Path")
-path_label.grid(row=2, column=1, sticky="w")
-path_entry = Entry(gui, textvariable=video_path, width=28)
-path_entry.grid(row=2, column=1, sticky='w', padx=30)
-btn_path_entry = tButton(gui, text="Browse", command=getvideo_path)
-btn_path_entry.grid(row=2, column=1, sticky='w', padx=210)
+    check_infobutton = Button(gui, text='i', font=myFont,
+                                bg='white', fg='blue', bd=0)
+    CreateToolTip(check_infobutton, text=check_info)
+    check_infobutton.grid(row=9, column=1, padx=290)
+    check = IntVar()
+    skel_check = Checkbutton(gui, text="(Recompute all)", variable=check)
+    skel_check.grid(row=9, column=1, sticky='w', padx=90)
 
-# Path selection info button
-path_info = "Browse to folder with original videos.\n\n" \
-            "Optional:\n \"To merge experiments from different\n" \
-            " days, create a new folder with sub-\n" \
-            " folders for each condition to be merged.\n" \
-            " Copy all *_bw_data.txt from each condition\n" \
-            " into this new folder.\n" \
-            " Select this folder path and run \"Analyze Data\" again!\""
+    framerate = StringVar()
+    framerate.set("30")
 
-path_infobutton = Button(gui, text='i', font=myFont,
-                            bg='white', fg='blue', bd=0)
-CreateToolTip(path_infobutton, text=path_info)
-path_infobutton.grid(row=2, column=1, padx=290)
+    framerate_label = Label(gui, text= "Framerate:           (fps)")
+    framerate_label.grid(row=10, column=1, sticky="w")
+    framerate_entry = Entry(gui, textvariable=framerate, width=3)
+    framerate_entry.grid(row=10, column=1, pady=5, padx=68, sticky='w')
 
-# GUI Separator background correction
-Separator(gui, orient="horizontal").grid(row=3, column=0, columnspan=2, sticky='ew', pady=5)
 
-# background correction GUI
+    btn_skel_start = tButton(gui, text="Start", command=skeletonization)
+    btn_skel_start.grid(row=11, column=1, sticky="w")
 
-gamma = StringVar()
+    progressbar_skel = Progressbar(gui, length=100)
+    progressbar_skel.grid(row=11, column=1, sticky='w', padx=90)
 
-gamma_label = Label(gui, text="Gamma:          ")
-gamma_label.grid(row=5, column=1, sticky="w")
-gamma_entry = Entry(gui, textvariable=gamma, width=3)
-gamma_entry.grid(row=5, column=1, pady=5, padx=68, sticky='w')
+    skel_done = Label(gui, text="Done!", font=fileFont)
 
-btn_preview_start = tButton(gui, text="Preview", command=background_check)
-btn_preview_start.grid(row=5, column=1, padx=210, sticky='w')
+    # GUI Separator normalize data
+    Separator(gui, orient="horizontal").grid(row=12, column=0, columnspan=2, sticky='ew', pady=5)
 
-# Gamma info button
-gamma_info = "Enter Gamma value depending on the brightness of the videos.\n" \
-             "Should be approximately between 0.7 and 1.3.\n" \
-             "Preview button creates a short video to check whether Gamma value is appropriate."
+    # Normalize Data GUI
+    normalize_title = Label(gui, text="Normalize Data", font=myFont)
+    normalize_title.grid(row=13, column=1, pady=10, sticky='w')
 
-gamma_infobutton = Button(gui, text='i', font=myFont,
-                             bg='white', fg='blue', bd=0)
-CreateToolTip(gamma_infobutton, text=gamma_info)
-gamma_infobutton.grid(row=5, column=1, padx=290)
-
-bg_title = Label(gui, text="Background Correction", font=myFont)
-bg_title.grid(row=4, column=1, pady=10, sticky='w')
-
-btn_bg_start = tButton(gui, text="Start", command=background_correction)
-btn_bg_start.grid(row=6, column=1, sticky='w')
-
-progressbar_bw = Progressbar(gui, length=100)
-progressbar_bw.grid(row=6, column=1, sticky='w', padx=90)
-
-bw_done = Label(gui, text="Done!", font=fileFont)
-
-# GUI Separator skeletonize
-Separator(gui, orient="horizontal").grid(row=7, column=0, columnspan=2, sticky='ew', pady=5)
-
-# skeletonize GUI
-skel_title = Label(gui, text="Skeletonize", font=myFont)
-skel_title.grid(row=9, column=1, pady=5, sticky='w')
-
-# Check info button
-check_info = "Keep unchecked if starting WormRuler for the first time.\n\n" \
-            "Unchecked:\n Skeletonization step will ignore videos" \
-            " already skeletonized.\n" \
-            " Can be useful if program was stopped in between.\n" \
-            " Consider deleting last \"*_raw_lengths.txt\"" \
-            " in folder.\n" \
-            "Checked:\n Skeletonization will be done for all videos.\n" \
-             " Can be useful if gamma value needed to be adjusted."
+    pulse_start = StringVar()
 
-check_infobutton = Button(gui, text='i', font=myFont,
-                            bg='white', fg='blue', bd=0)
-CreateToolTip(check_infobutton, text=check_info)
-check_infobutton.grid(row=9, column=1, padx=290)
-check = IntVar()
-skel_check = Checkbutton(gui, text="(Override existing skeletons)", variable=check)
-skel_check.grid(row=9, column=1, sticky='w', padx=90)
+    pulse_label = Label(gui, text="Pulse-start:          (s)")
+    pulse_label.grid(row=14, column=1, sticky="w")
+    pulse_entry = Entry(gui, textvariable=pulse_start, width=3)
+    pulse_entry.grid(row=14, column=1, pady=5, padx=68, sticky='w')
 
-framerate = StringVar()
-framerate.set("30")
+    #Entry for boundaries
+    lower_bound = StringVar()
+    lower_bound.set("0.8")
 
-framerate_label = Label(gui, text= "Framerate:           (fps)")
-framerate_label.grid(row=10, column=1, sticky="w")
-framerate_entry = Entry(gui, textvariable=framerate, width=3)
-framerate_entry.grid(row=10, column=1, pady=5, padx=68, sticky='w')
+    lower_bound_label = Label(gui, text="Lower boundary:       ")
+    lower_bound_label.grid(row=15, column=1, sticky="w")
+    lower_bound_entry = Entry(gui, textvariable=lower_bound, width=3)
+    lower_bound_entry.grid(row=15, column=1, pady=5, padx=100, sticky='w')
 
+    upper_bound = StringVar()
+    upper_bound.set("1.2")
 
-btn_skel_start = tButton(gui, text="Start", command=skeletonization)
-btn_skel_start.grid(row=11, column=1, sticky="w")
+    upper_bound_label = Label(gui, text="Upper boundary:       ")
+    upper_bound_label.grid(row=15, column=1, padx=130, sticky="w")
+    upper_bound_entry = Entry(gui, textvariable=upper_bound, width=3)
+    upper_bound_entry.grid(row=15, column=1, pady=5, padx=230, sticky='w')
 
-progressbar_skel = Progressbar(gui, length=100)
-progressbar_skel.grid(row=11, column=1, sticky='w', padx=90)
+    # Boundaries info button
+    bound_info = "Enter lower and upper boundaries.\n" \
+                 "Boundaries refer to the relative change compared to the average before pulse.\n" \
+                 "Values lower or higher than the set boundaries\n" \
+                 "are discarded from the analysis after normalization.\n" \
+                 "For C. elegans we suggest using 0.8 and 1.2."
 
-skel_done = Label(gui, text="Done!", font=fileFont)
+    bound_infobutton = Button(gui, text='i', font=myFont,
+                                bg='white', fg='blue', bd=0)
+    CreateToolTip(bound_infobutton, text=bound_info)
+    bound_infobutton.grid(row=15, column=1, padx=290)
 
-# GUI Separator normalize data
-Separator(gui, orient="horizontal").grid(row=12, column=0, columnspan=2, sticky='ew', pady=5)
 
-# Normalize Data GUI
-normalize_title = Label(gui, text="Normalize Data", font=myFont)
-normalize_title.grid(row=13, column=1, pady=10, sticky='w')
 
-pulse_start = StringVar()
+    btn_normalize_start = tButton(gui, text="Normalize", command=normalize)
+    btn_normalize_start.grid(row=17, column=1, sticky='w')
+
+    progressbar_normalize = Progressbar(gui, length=100)
+    progressbar_normalize.grid(row=17, column=1, sticky='w', padx=90)
 
-pulse_label = Label(gui, text="Pulse-start:          (s)")
-pulse_label.grid(row=14, column=1, sticky="w")
-pulse_entry = Entry(gui, textvariable=pulse_start, width=3)
-pulse_entry.grid(row=14, column=1, pady=5, padx=68, sticky='w')
+    normalize_done = Label(gui, text="Done!", font=fileFont)
 
-#Entry for boundaries
-lower_bound = StringVar()
-lower_bound.set("0.8")
+    # GUI Separator analyze data
+    Separator(gui, orient="horizontal").grid(row=18, column=0, columnspan=2, sticky='ew', pady=5)
+
+    # Analyze Data GUI
+    data_title = Label(gui, text="Analyze Data", font=myFont)
+    data_title.grid(row=19, column=1, pady=10, sticky='w')
+
+    btn_data_start = tButton(gui, text="Analyze", command=data_analyis)
+    btn_data_start.grid(row=20, column=1, sticky='w')
+
+    progressbar_data = Progressbar(gui, length=100)
+    progressbar_data.grid(row=20, column=1, sticky='w', padx=90)
+
+    data_done = Label(gui, text="Done!", font=fileFont)
+
+    # GUI Separator all and close buttons
+    Separator(gui, orient="horizontal").grid(row=21, column=0, columnspan=2, sticky='ew', pady=10)
 
-lower_bound_label = Label(gui, text="Lower boundary:       ")
-lower_bound_label.grid(row=15, column=1, sticky="w")
-lower_bound_entry = Entry(gui, textvariable=lower_bound, width=3)
-lower_bound_entry.grid(row=15, column=1, pady=5, padx=100, sticky='w')
+    # GUI All-in-one button
+    btn_all = Button(gui, text="Start all",
+                        relief='groove', activebackground='#99ccff',
+                        command=run_all)
+    btn_all.grid(row=22, column=1, padx=90, sticky="w")
 
-upper_bound = StringVar()
-upper_bound.set("1.2")
+    # GUI Close Window Button
+    btn_close = Button(gui, text="Close",
+                          bg='#ff6666', relief='groove',
+                          command=close)
+    btn_close.grid(row=22, column=1, padx=150, sticky="w")
 
-upper_bound_label = Label(gui, text="Upper boundary:       ")
-upper_bound_label.grid(row=15, column=1, padx=130, sticky="w")
-upper_bound_entry = Entry(gui, textvariable=upper_bound, width=3)
-upper_bound_entry.grid(row=15, column=1, pady=5, padx=230, sticky='w')
+    # GUI option to write *_bw.gif and *_skel.gif in "Start all"
+    gif_check = IntVar()
+    gif_checkbutton = Checkbutton(gui, text="(Save GIFs)", variable=gif_check)
+    gif_checkbutton.grid(row=22, column=1, padx=200, sticky="w")
 
-# Boundaries info button
-bound_info = "Enter lower and upper boundaries.\n" \
-             "Boundaries refer to the relative change compared to the average before pulse.\n" \
-             "Values lower or higher than the set boundaries\n" \
-             "are discarded from the analysis after normalization.\n" \
-             "For C. elegans we suggest using 0.8 and 1.2."
+    # GUI Cancel Button, stops the running step after the current frame
+    btn_cancel = Button(gui, text="Cancel",
+                           relief='groove', state='disabled',
+                           command=cancel_step)
+    btn_cancel.grid(row=22, column=1, sticky="w")
 
-bound_infobutton = Button(gui, text='i', font=myFont,
-                            bg='white', fg='blue', bd=0)
-CreateToolTip(bound_infobutton, text=bound_info)
-bound_infobutton.grid(row=15, column=1, padx=290)
+    # buttons which start a step, disabled while a step is running
+    step_buttons = [btn_preview_start, btn_bg_start, btn_skel_start, btn_normalize_start, btn_data_start, btn_all]
 
+    # GUI entry for number of videos processed in parallel
+    workers = StringVar()
+    workers.set("1")
 
+    workers_label = Label(gui, text="Workers:")
+    workers_label.grid(row=23, column=1, padx=90, sticky="w")
+    workers_entry = Entry(gui, textvariable=workers, width=3)
+    workers_entry.grid(row=23, column=1, pady=5, padx=150, sticky='w')
 
-btn_normalize_start = tButton(gui, text="Normalize", command=normalize)
-btn_normalize_start.grid(row=17, column=1, sticky='w')
+    # Workers info button
+    workers_info = "Number of videos processed at the same time.\n" \
+                   "Each worker uses one CPU core and its own memory.\n" \
+                   "For skeletonization, long videos are split into\n" \
+                   "chunks of frames which are processed in parallel."
+
+    workers_infobutton = Button(gui, text='i', font=myFont,
+                                bg='white', fg='blue', bd=0)
+    CreateToolTip(workers_infobutton, text=workers_info)
+    workers_infobutton.grid(row=23, column=1, padx=290)
 
-progressbar_normalize = Progressbar(gui, length=100)
-progressbar_normalize.grid(row=17, column=1, sticky='w', padx=90)
+    # GUI entry for downscaling of raw videos while decoding
+    downscale = StringVar()
+    downscale.set("1")
 
-normalize_done = Label(gui, text="Done!", font=fileFont)
+    downscale_label = Label(gui, text="Downscale:")
+    downscale_label.grid(row=24, column=1, padx=77, sticky="w")
+    downscale_entry = Entry(gui, textvariable=downscale, width=3)
+    downscale_entry.grid(row=24, column=1, pady=5, padx=150, sticky='w')
 
-# GUI Separator analyze data
-Separator(gui, orient="horizontal").grid(row=18, column=0, columnspan=2, sticky='ew', pady=5)
+    # Downscale info button
+    downscale_info = "Factor by which raw videos are downscaled while decoding (1: full resolution).\n" \
+                     "Speeds up processing of high resolution videos, lengths are\n" \
+                     "converted back to pixels of the original video."
 
-# Analyze Data GUI
-data_title = Label(gui, text="Analyze Data", font=myFont)
-data_title.grid(row=19, column=1, pady=10, sticky='w')
+    downscale_infobutton = Button(gui, text='i', font=myFont,
+                                  bg='white', fg='blue', bd=0)
+    CreateToolTip(downscale_infobutton, text=downscale_info)
+    downscale_infobutton.grid(row=24, column=1, padx=290)
 
-btn_data_start = tButton(gui, text="Analyze", command=data_analyis)
-btn_data_start.grid(row=20, column=1, sticky='w')
+    # GUI option to crop raw videos to the ROI before background correction
+    crop_check = IntVar()
+    crop_checkbutton = Checkbutton(gui, text="(Crop first)", variable=crop_check)
+    crop_checkbutton.grid(row=25, column=1, padx=150, sticky="w")
 
-progressbar_data = Progressbar(gui, length=100)
-progressbar_data.grid(row=20, column=1, sticky='w', padx=90)
-
-data_done = Label(gui, text="Done!", font=fileFont)
-
-# GUI Separator all and close buttons
-Separator(gui, orient="horizontal").grid(row=21, column=0, columnspan=2, sticky='ew', pady=10)
-
-# GUI All-in-one button
-btn_all = Button(gui, text="Start all",
-                    relief='groove', activebackground='#99ccff',
-                    command=run_all)
-btn_all.grid(row=22, column=1, padx=90, sticky="w")
-
-# GUI Close Window Button
-btn_close = Button(gui, text="Close",
-                      bg='#ff6666', relief='groove',
-                      command=close)
-btn_close.grid(row=22, column=1, padx=150, sticky="w")
-
-# GUI window loop
-gui.mainloop()
\ No newline at end of file
+    # Crop first info button
+    crop_info = "Crop raw videos to the ROI before background correction.\n" \
+                "Thresholding and cleanup only process the ROI, *_bw.npz only contains the ROI.\n" \
+                "Select the ROI on the raw videos before background correction."
+
+    crop_infobutton = Button(gui, text='i', font=myFont,
+                             bg='white', fg='blue', bd=0)
+    CreateToolTip(crop_infobutton, text=crop_info)
+    crop_infobutton.grid(row=25, column=1, padx=290)
+
+    # GUI selection of the skeleton length engine
+    engine = StringVar()
+    engine.set("filfinder")
+
+    engine_label = Label(gui, text="Skeleton:")
+    engine_label.grid(row=26, column=1, padx=85, sticky="w")
+    engine_menu = OptionMenu(gui, engine, "filfinder", "native", "parity")
+    engine_menu.grid(row=26, column=1, padx=150, sticky="w")
+
+    # Skeleton info button
+    engine_info = "Method used to measure the skeleton length.\n" \
+                  "filfinder: FilFinder2D (default).\n" \
+                  "native: faster skeleton graph analysis, results differ slightly from FilFinder.\n" \
+                  "parity: lengths from FilFinder, differences to native are written to *_parity.txt."
+
+    engine_infobutton = Button(gui, text='i', font=myFont,
+                               bg='white', fg='blue', bd=0)
+    CreateToolTip(engine_infobutton, text=engine_info)
+    engine_infobutton.grid(row=26, column=1, padx=290)
+
+    # GUI option to track the worm between frames
+    track_check = IntVar()
+    track_checkbutton = Checkbutton(gui, text="(Track worm)", variable=track_check)
+    track_checkbutton.grid(row=27, column=1, padx=150, sticky="w")
+
+    # Track worm info button
+    track_info = "Skeletonize only the area around the worm in the previous frame.\n" \
+                 "The whole ROI is used again if the worm leaves this area or no length was found.\n" \
+                 "Other objects far from the worm are ignored while it is tracked."
+
+    track_infobutton = Button(gui, text='i', font=myFont,
+                              bg='white', fg='blue', bd=0)
+    CreateToolTip(track_infobutton, text=track_info)
+    track_infobutton.grid(row=27, column=1, padx=290)
+
+    # GUI option to save checkpoints during skeletonization
+    resume_check = IntVar()
+    resume_checkbutton = Checkbutton(gui, text="(Resumable)", variable=resume_check)
+    resume_checkbutton.grid(row=28, column=1, padx=150, sticky="w")
+
+    # Resumable info button
+    resume_info = "Save finished chunks of frames during skeletonization (size set by \"Chunk\").\n" \
+                  "If WormRuler is closed or crashes, skeletonization continues\n" \
+                  "from the last saved chunk when it is started again with the same settings,\n" \
+                  "videos shorter than one chunk start again from their first frame.\n" \
+                  "Chunks are kept in *_checkpoint_*.pkl files until a video is complete."
+
+    resume_infobutton = Button(gui, text='i', font=myFont,
+                               bg='white', fg='blue', bd=0)
+    CreateToolTip(resume_infobutton, text=resume_info)
+    resume_infobutton.grid(row=28, column=1, padx=290)
+
+    # GUI option to clean up only the objects of worm size of every frame
+    worm_check = IntVar()
+    worm_checkbutton = Checkbutton(gui, text="(Worm only)", variable=worm_check)
+    worm_checkbutton.grid(row=29, column=1, padx=150, sticky="w")
+
+    # Worm only info button
+    worm_info = "Keep only the objects of worm size of every frame after background correction.\n" \
+                "Faster than removing small objects and holes in separate passes:\n" \
+                "the frame is labelled once, closing and hole filling only process the worm.\n" \
+                "Best if there is a single worm per video."
+
+    worm_infobutton = Button(gui, text='i', font=myFont,
+                             bg='white', fg='blue', bd=0)
+    CreateToolTip(worm_infobutton, text=worm_info)
+    worm_infobutton.grid(row=29, column=1, padx=290)
+
+    # GUI option to use the kernels compiled by numba
+    numba_check = IntVar()
+    numba_checkbutton = Checkbutton(gui, text="(Numba)", variable=numba_check)
+    numba_checkbutton.grid(row=30, column=1, padx=150, sticky="w")
+
+    # Numba info button
+    numba_info = "Thinning and removal of small objects and holes compiled by numba.\n" \
+                 "Same results as skimage, several times faster. The first run compiles the kernels.\n" \
+                 "skimage is used if numba is not installed."
+
+    numba_infobutton = Button(gui, text='i', font=myFont,
+                              bg='white', fg='blue', bd=0)
+    CreateToolTip(numba_infobutton, text=numba_info)
+    numba_infobutton.grid(row=30, column=1, padx=290)
+
+    # GUI option to stop skeletonization of unusable videos
+    unusable_check = IntVar()
+    unusable_checkbutton = Checkbutton(gui, text="(Skip unusable)", variable=unusable_check)
+    unusable_checkbutton.grid(row=31, column=1, padx=150, sticky="w")
+
+    # Skip unusable info button
+    unusable_info = "Stop skeletonization of a video as soon as half of its frames have no length.\n" \
+                    "Animals with 50% or less measured lengths are excluded by data analysis anyway.\n" \
+                    "Stopped videos are reported in *_unusable.txt, check their Gamma value and focus."
+
+    unusable_infobutton = Button(gui, text='i', font=myFont,
+                                 bg='white', fg='blue', bd=0)
+    CreateToolTip(unusable_infobutton, text=unusable_info)
+    unusable_infobutton.grid(row=31, column=1, padx=290)
+
+    # GUI entry for the number of frames thresholded together
+    batch_frames = StringVar()
+    batch_frames.set("0")
+
+    batch_label = Label(gui, text="Batch:")
+    batch_label.grid(row=32, column=1, padx=103, sticky="w")
+    batch_entry = Entry(gui, textvariable=batch_frames, width=3)
+    batch_entry.grid(row=32, column=1, pady=5, padx=150, sticky='w')
+
+    # Batch info button
+    batch_info = "Number of frames converted to grayscale and thresholded together (0: frame by frame).\n" \
+                 "Faster for long videos, results only differ for pixels on a histogram bin edge.\n" \
+                 "Only used by the per-frame threshold (not with \"Median bg\")."
+
+    batch_infobutton = Button(gui, text='i', font=myFont,
+                              bg='white', fg='blue', bd=0)
+    CreateToolTip(batch_infobutton, text=batch_info)
+    batch_infobutton.grid(row=32, column=1, padx=290)
+
+    # GUI entry for the number of frames of a chunk (parallel skeletonization and "Resumable")
+    chunk_frames = StringVar()
+    chunk_frames.set("500")
+
+    chunk_label = Label(gui, text="Chunk:")
+    chunk_label.grid(row=33, column=1, padx=100, sticky="w")
+    chunk_entry = Entry(gui, textvariable=chunk_frames, width=5)
+    chunk_entry.grid(row=33, column=1, pady=5, padx=150, sticky='w')
+
+    # Chunk info button
+    chunk_info = "Number of frames of a chunk (0: whole videos).\n" \
+                 "With several workers, chunks of one video are processed in parallel.\n" \
+                 "With \"Resumable\", every finished chunk is saved: smaller chunks lose\n" \
+                 "less work when skeletonization is interrupted, but write more files."
+
+    chunk_infobutton = Button(gui, text='i', font=myFont,
+                              bg='white', fg='blue', bd=0)
+    CreateToolTip(chunk_infobutton, text=chunk_info)
+    chunk_infobutton.grid(row=33, column=1, padx=290)
+
+    # background thread of the running step and the calls it sends to the GUI
+    step_thread = None
+    cancel_manager = None
+    cancel_event = None
+    events = Queue()
+    gui.after(100, poll_events)
+
+    # GUI window loop
+    gui.mainloop()